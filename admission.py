@@ -0,0 +1,138 @@
+"""
+Admission control for graph generation
+Token-bucket rate limits per user, per team and globally, plus a bounded
+number of concurrent renders
+"""
+
+import os
+import time
+import logging
+import threading
+import contextlib
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Classic token bucket: refills at rate tokens/second up to capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def available(self, cost=1):
+        self._refill()
+        return self.tokens >= self._cost(cost)
+
+    def take(self, cost=1):
+        self.tokens -= self._cost(cost)
+
+    def retry_after(self, cost=1):
+        """Seconds until cost tokens are available"""
+        self._refill()
+        needed = self._cost(cost)
+        if self.tokens >= needed or self.rate <= 0:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def _cost(self, cost):
+        # A request costing more than the burst size drains the bucket instead of never fitting
+        return min(cost, self.capacity)
+
+
+class AdmissionDecision:
+    def __init__(self, admitted, reason=None, retry_after=0.0):
+        self.admitted = admitted
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Decides whether a generation may be queued, and bounds concurrent renders"""
+
+    def __init__(self, user_rate_per_min=None, user_burst=None, team_rate_per_min=None,
+                 team_burst=None, global_rate_per_min=None, global_burst=None,
+                 max_concurrent_renders=None, max_tracked_keys=10000):
+        def setting(value, env_name, default):
+            return value if value is not None else float(os.environ.get(env_name, default))
+
+        self.user_limit = (setting(user_rate_per_min, "ROI_USER_RATE_PER_MIN", 6) / 60,
+                           setting(user_burst, "ROI_USER_BURST", 3))
+        self.team_limit = (setting(team_rate_per_min, "ROI_TEAM_RATE_PER_MIN", 30) / 60,
+                           setting(team_burst, "ROI_TEAM_BURST", 10))
+        self.global_bucket = TokenBucket(setting(global_rate_per_min, "ROI_GLOBAL_RATE_PER_MIN", 120) / 60,
+                                         setting(global_burst, "ROI_GLOBAL_BURST", 20))
+        self.max_concurrent_renders = int(setting(max_concurrent_renders, "ROI_MAX_CONCURRENT_RENDERS", 2))
+        self.max_tracked_keys = max_tracked_keys
+
+        self._buckets = OrderedDict()  # ('user'|'team', id) -> TokenBucket
+        self._lock = threading.Lock()
+        self._render_slots = threading.BoundedSemaphore(self.max_concurrent_renders)
+        self._active_renders = 0
+        self.admitted = 0
+        self.rejected = {'user': 0, 'team': 0, 'global': 0}
+
+    def _bucket(self, kind, key, limit):
+        bucket_key = (kind, key)
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            bucket = TokenBucket(*limit)
+            self._buckets[bucket_key] = bucket
+            # Forget the least recently seen users/teams once we track too many
+            while len(self._buckets) > self.max_tracked_keys:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(bucket_key)
+        return bucket
+
+    def check(self, user_id, team_id=None, cost=1):
+        """Take cost tokens (one per graph) from each applicable bucket, or none if any is short"""
+        with self._lock:
+            buckets = [('user', self._bucket('user', user_id, self.user_limit))]
+            if team_id:
+                buckets.append(('team', self._bucket('team', team_id, self.team_limit)))
+            buckets.append(('global', self.global_bucket))
+
+            for kind, bucket in buckets:
+                if not bucket.available(cost):
+                    self.rejected[kind] += 1
+                    logger.warning(f"Rate limited {kind} (user={user_id}, team={team_id})")
+                    return AdmissionDecision(False, kind, bucket.retry_after(cost))
+
+            for _, bucket in buckets:
+                bucket.take(cost)
+            self.admitted += 1
+            return AdmissionDecision(True)
+
+    def renders_saturated(self):
+        """True when every render slot is busy, so new work will wait in the queue"""
+        with self._lock:
+            return self._active_renders >= self.max_concurrent_renders
+
+    @contextlib.contextmanager
+    def render_slot(self):
+        """Hold one of the bounded render slots for the duration of a generation"""
+        with self._render_slots:
+            with self._lock:
+                self._active_renders += 1
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._active_renders -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'active_renders': self._active_renders,
+                'max_concurrent_renders': self.max_concurrent_renders,
+            }
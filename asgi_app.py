@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Asyncio serving mode for the ROI Slack bot
+Slack, OpenAI and upload calls are awaited on one event loop and renders run on the
+render thread pool, so a single process can hold hundreds of /roi requests in flight.
+The Flask/gunicorn mode in roi-slackbot.py is unchanged.
+
+Run with:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 3000
+"""
+
+import os
+import time
+import asyncio
+import logging
+import importlib
+from urllib.parse import parse_qs
+from dotenv import load_dotenv
+from admission import AdmissionController
+from render_profiles import get_profile
+from metrics import time_stage, render_prometheus
+from slack_dedup import async_dedup_middleware
+from slack_messages import (HIGH_RES_PROFILE, EMPTY_REQUEST_TEXT, EMPTY_BATCH_TEXT, QUEUE_FULL_TEXT, HELP_TEXT,
+                            rate_limited_text, generating_text, upload_kwargs, high_res_blocks, error_text,
+                            parse_batch_text, batch_generating_text, batch_upload_kwargs, preview_upload_kwargs,
+                            uploaded_file_id)
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+slack_bot_token = os.environ.get("SLACK_BOT_TOKEN")
+slack_signing_secret = os.environ.get("SLACK_SIGNING_SECRET")
+
+# Rate limits per user, team and globally; renders are bounded by the render thread pool
+admission = AdmissionController()
+
+# Generations awaiting the LLM or a render thread; more are turned away
+max_in_flight = int(os.environ.get("ROI_MAX_IN_FLIGHT", 200))
+_in_flight = set()
+
+_graph_generator = None
+
+async def get_graph_generator():
+    """Import graph_generator off the event loop on first use"""
+    global _graph_generator
+    if _graph_generator is None:
+        start = time.perf_counter()
+        _graph_generator = await asyncio.get_running_loop().run_in_executor(
+            None, importlib.import_module, "graph_generator"
+        )
+        logger.info(f"Graph generator imported successfully in {time.perf_counter() - start:.2f}s")
+    return _graph_generator
+
+async def process_roi_request(client, payload):
+    """Generate and upload a graph for an accepted /roi request"""
+    user_text = payload['user_text']
+    channel_id = payload['channel_id']
+    user_id = payload['user_id']
+    profile = get_profile(payload.get('profile'))
+    preview_id = None
+    
+    try:
+        generator = await get_graph_generator()
+        
+        # Post a cheap preview first (a template render is already the final graph)
+        image_data = None
+        try_template = True
+        if generator.speculative_preview_enabled():
+            with time_stage('preview'):
+                preview_data, is_final = await asyncio.get_running_loop().run_in_executor(
+                    generator.get_render_executor(), generator.generate_roi_graph_preview, user_text, profile
+                )
+            try_template = False
+            if is_final:
+                image_data = preview_data
+            else:
+                # The preview is only a head start; without it the user still gets the full graph
+                try:
+                    with time_stage('slack_upload'):
+                        result = await client.files_upload_v2(
+                            channel=channel_id, **preview_upload_kwargs(user_text, profile, preview_data)
+                        )
+                    preview_id = uploaded_file_id(result)
+                except Exception as e:
+                    logger.warning(f"Could not post preview graph: {str(e)}")
+        
+        if image_data is None:
+            logger.info(f"Generating {profile.name} graph for user {user_id}: {user_text}")
+            with time_stage('generate'):
+                image_data = await generator.generate_roi_graph_async(user_text, profile, try_template=try_template)
+            
+            # The LLM failed and produced the preview's fallback graph: the preview stands
+            if preview_id and image_data == preview_data:
+                logger.info(f"Keeping the preview as the final graph for user {user_id}")
+                return
+        
+        with time_stage('slack_upload'):
+            await client.files_upload_v2(channel=channel_id, **upload_kwargs(user_text, profile, image_data))
+        logger.info(f"Successfully uploaded graph for user {user_id}")
+        if preview_id:
+            await delete_preview(client, preview_id)
+        
+        # Offer the full-resolution render on demand
+        if profile.name != HIGH_RES_PROFILE:
+            await offer_high_res(client, channel_id, user_id, user_text)
+        
+    except Exception as e:
+        logger.error(f"Error generating graph: {str(e)}")
+        # Once a preview is up it is the answer; only report errors when nothing was posted
+        if not preview_id:
+            await client.chat_postMessage(channel=channel_id, text=error_text(e))
+
+async def offer_high_res(client, channel_id, user_id, user_text):
+    """Offer the full-resolution render; the graph is already posted, so a failure here is only logged"""
+    try:
+        await client.chat_postEphemeral(
+            channel=channel_id,
+            user=user_id,
+            text="Need a sharper copy of this graph?",
+            blocks=high_res_blocks(user_text)
+        )
+    except Exception as e:
+        logger.warning(f"Could not offer a high-res copy to user {user_id}: {str(e)}")
+
+async def delete_preview(client, file_id):
+    """Remove a preview once the full graph is posted"""
+    try:
+        await client.files_delete(file=file_id)
+    except Exception as e:
+        logger.warning(f"Could not delete preview {file_id}: {str(e)}")
+
+async def process_roi_batch_request(client, payload):
+    """Generate every graph of a /roi-batch request concurrently and upload them together"""
+    items = payload['items']
+    channel_id = payload['channel_id']
+    profile = get_profile(payload.get('profile'))
+
+    try:
+        generator = await get_graph_generator()
+
+        logger.info(f"Generating batch of {len(items)} {profile.name} graphs for user {payload['user_id']}")
+        with time_stage('generate'):
+            images = await asyncio.gather(
+                *[generator.generate_roi_graph_async(item, profile) for item in items],
+                return_exceptions=True
+            )
+
+        results = list(zip(items, images))
+        upload = batch_upload_kwargs(results, profile)
+        if not upload['file_uploads']:
+            raise results[0][1]
+
+        with time_stage('slack_upload'):
+            await client.files_upload_v2(channel=channel_id, **upload)
+        logger.info(f"Successfully uploaded {len(upload['file_uploads'])} graphs for user {payload['user_id']}")
+
+    except Exception as e:
+        logger.error(f"Error generating graph batch: {str(e)}")
+        await client.chat_postMessage(channel=channel_id, text=error_text(e))
+
+def start_roi_request(client, payload, process=process_roi_request):
+    """
+    Apply admission control and start the generation in the background.
+    Returns None when started, or a message when the request is shed.
+    """
+    # A batch counts against the rate limits once per graph
+    cost = len(payload.get('items', ())) or 1
+    decision = admission.check(payload['user_id'], payload.get('team_id'), cost=cost)
+    if not decision.admitted:
+        return rate_limited_text(decision)
+    if len(_in_flight) >= max_in_flight:
+        logger.warning(f"{len(_in_flight)} generations in flight, rejecting request from user {payload['user_id']}")
+        return QUEUE_FULL_TEXT
+
+    # Keep a reference so the task isn't garbage collected mid-flight
+    task = asyncio.ensure_future(process(client, payload))
+    _in_flight.add(task)
+    task.add_done_callback(_in_flight.discard)
+    return None
+
+slack_app = None
+slack_handler = None
+
+if not slack_bot_token or not slack_signing_secret:
+    logger.error("SLACK_BOT_TOKEN and SLACK_SIGNING_SECRET must be set - Slack handlers are disabled")
+else:
+    from slack_bolt.async_app import AsyncApp
+    from slack_bolt.adapter.asgi.async_handler import AsyncSlackRequestHandler
+
+    slack_app = AsyncApp(token=slack_bot_token, signing_secret=slack_signing_secret)
+    slack_handler = AsyncSlackRequestHandler(slack_app)
+    slack_app.use(async_dedup_middleware)
+
+    @slack_app.command("/roi")
+    async def handle_roi_command(ack, respond, command, client):
+        """Handle /roi slash command"""
+        with time_stage('slack_ack'):
+            await ack()
+
+        user_text = command['text']
+        if not user_text.strip():
+            await respond({"text": EMPTY_REQUEST_TEXT, "response_type": "ephemeral"})
+            return
+
+        rejection = start_roi_request(client, {
+            "user_text": user_text,
+            "channel_id": command['channel_id'],
+            "user_id": command['user_id'],
+            "team_id": command.get('team_id')
+        })
+        await respond({"text": rejection or generating_text(user_text), "response_type": "ephemeral"})
+
+    @slack_app.action("roi_high_res")
+    async def handle_high_res_action(ack, body, respond, client):
+        """Re-render a graph with the high-res profile when its button is clicked"""
+        await ack()
+
+        user_text = body['actions'][0]['value']
+        rejection = start_roi_request(client, {
+            "user_text": user_text,
+            "channel_id": body['channel']['id'],
+            "user_id": body['user']['id'],
+            "team_id": body.get('team', {}).get('id'),
+            "profile": HIGH_RES_PROFILE
+        })
+        if rejection:
+            await respond({"text": rejection, "response_type": "ephemeral", "replace_original": False})
+            return
+
+        await respond({
+            "text": f"🔍 Rendering a high-res version of: *{user_text}*",
+            "response_type": "ephemeral",
+            "replace_original": True
+        })
+
+    @slack_app.command("/roi-batch")
+    async def handle_roi_batch_command(ack, respond, command, client):
+        """Handle /roi-batch: several graph requests separated by ';' or new lines"""
+        with time_stage('slack_ack'):
+            await ack()
+
+        items, skipped = parse_batch_text(command['text'], int(os.environ.get("ROI_BATCH_MAX_ITEMS", 6)))
+        if not items:
+            await respond({"text": EMPTY_BATCH_TEXT, "response_type": "ephemeral"})
+            return
+
+        rejection = start_roi_request(client, {
+            "items": items,
+            "channel_id": command['channel_id'],
+            "user_id": command['user_id'],
+            "team_id": command.get('team_id')
+        }, process=process_roi_batch_request)
+        if rejection:
+            await respond({"text": rejection, "response_type": "ephemeral"})
+            return
+
+        await respond({"text": batch_generating_text(items, skipped), "response_type": "ephemeral"})
+
+    @slack_app.command("/roi-help")
+    async def handle_help_command(ack, respond):
+        """Provide help for the ROI bot"""
+        await ack()
+        await respond({"text": HELP_TEXT, "response_type": "ephemeral"})
+
+async def _send_text(send, status, body, content_type="text/plain; charset=utf-8"):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode('ascii'))],
+    })
+    await send({'type': 'http.response.body', 'body': body.encode('utf-8')})
+
+async def app(scope, receive, send):
+    """ASGI entry point: health, metrics and URL verification here, Slack requests to Bolt"""
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        path = scope['path']
+        if path in ('/', '/health'):
+            await _send_text(send, 200, "ROI Bot is running! 🎯")
+            return
+        if path == '/metrics':
+            await _send_text(send, 200, render_prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+            return
+        if path == '/slack/events':
+            # Handle URL verification challenge
+            query = parse_qs(scope.get('query_string', b'').decode('utf-8'))
+            await _send_text(send, 200, query.get('challenge', ["OK"])[0])
+            return
+
+    if slack_handler is not None:
+        await slack_handler(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    else:
+        await _send_text(send, 503, "Slack app not configured")
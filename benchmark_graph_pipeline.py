@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the ROI graph pipeline
+Replays a corpus of requests through the generation stages with a deterministic
+stub LLM and reports latency percentiles, throughput, peak RSS and image sizes as JSON
+
+Usage:
+    python benchmark_graph_pipeline.py --corpus requests.jsonl --output bench.json
+    python benchmark_graph_pipeline.py --compare bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+import resource
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_CORPUS = [
+    "VR training vs traditional training ROI over 3 years",
+    "Cost savings from VR implementation quarterly breakdown",
+    "Training efficiency improvements monthly comparison",
+    "Employee satisfaction before and after VR training",
+    "Simple ROI test over 6 months",
+]
+
+COLORS = ['#2E86AB', '#A23B72', '#F18F01', '#6A994E']
+
+
+def load_corpus(path):
+    """Read requests from a JSONL file (text/user_request/title field) or a plain text file"""
+    requests = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                record = json.loads(line)
+                text = record.get('text') or record.get('user_request') or record.get('title')
+                if text:
+                    requests.append(text)
+            else:
+                requests.append(line)
+    return requests
+
+
+def recorded_code(user_request):
+    """Deterministic stand-in for the graph code the LLM would return for a request"""
+    rng = random.Random(int(hashlib.sha256(user_request.encode('utf-8')).hexdigest()[:8], 16))
+    periods = rng.choice([['Q1', 'Q2', 'Q3', 'Q4'], ['Year 1', 'Year 2', 'Year 3'],
+                          ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun']])
+    lines = []
+    for i in range(rng.randint(1, 3)):
+        value = rng.randint(0, 20)
+        series = []
+        for _ in periods:
+            value += rng.randint(2, 25)
+            series.append(value)
+        lines.append(f"plt.plot(periods, {series}, marker='o', linewidth=3, "
+                     f"label='Series {i + 1}', color='{COLORS[i]}')")
+    plot_lines = "\n".join(lines)
+    title = user_request[:60].replace("'", "")
+    return f"""```python
+import matplotlib.pyplot as plt
+import numpy as np
+
+periods = {periods}
+plt.figure(figsize=(12, 8))
+{plot_lines}
+plt.title('{title}', fontsize=18, fontweight='bold', pad=20)
+plt.xlabel('Time Period', fontsize=14)
+plt.ylabel('ROI (%)', fontsize=14)
+plt.legend(fontsize=12)
+plt.grid(True, alpha=0.3)
+plt.tight_layout()
+plt.savefig('output.png', dpi=300, bbox_inches='tight')
+plt.close()
+```"""
+
+
+def install_stub_llm(llm_latency_ms, recordings=None):
+    """Point the shared OpenAI client at a local transport that replays recorded code"""
+    import llm_client
+
+    def reply(body):
+        if llm_latency_ms:
+            time.sleep(llm_latency_ms / 1000.0)
+        user_message = body['messages'][-1]['content']
+        user_request = user_message.split(': ', 1)[-1]
+        if recordings and user_request in recordings:
+            return recordings[user_request]
+        return recorded_code(user_request)
+
+    llm_client.configure_client(llm_client.make_stub_transport(reply))
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(p):
+        index = min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+        return round(ordered[index] * 1000, 2)
+
+    return {
+        'count': len(ordered),
+        'p50_ms': pick(50),
+        'p90_ms': pick(90),
+        'p99_ms': pick(99),
+        'max_ms': round(ordered[-1] * 1000, 2),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 2),
+    }
+
+
+def time_stage(fn, inputs, repeat):
+    samples = []
+    outputs = []
+    for _ in range(repeat):
+        for item in inputs:
+            start = time.perf_counter()
+            outputs.append(fn(item))
+            samples.append(time.perf_counter() - start)
+    return samples, outputs
+
+
+def image_stats(images):
+    sizes = [len(image) for image in images if image]
+    if not sizes:
+        return {}
+    return {'min': min(sizes), 'max': max(sizes), 'mean': round(sum(sizes) / len(sizes))}
+
+
+def peak_rss_mb():
+    # ru_maxrss is KB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_benchmark(corpus, repeat, concurrency_levels, profile, use_docker, use_processes=False):
+    import graph_generator
+    import safe_executor
+    from graph_generator_safe import SafeGraphGenerator
+
+    results = {'stages': {}, 'throughput': {}}
+
+    # Warm up imports, fonts and the stub client so the first sample is not an outlier
+    graph_generator.execute_graph_code(graph_generator.get_fallback_graph_code("warmup"), "warmup", profile)
+
+    samples, codes = time_stage(graph_generator.get_graph_code_from_llm, corpus, repeat)
+    results['stages']['llm'] = percentiles(samples)
+
+    # Share of the corpus the template library answers without the LLM, and its render time
+    from roi_templates import match_template
+    templated = [request for request in corpus if match_template(request) is not None]
+    results['template_hit_rate'] = round(len(templated) / len(corpus), 3) if corpus else 0.0
+    if templated:
+        samples, images = time_stage(
+            lambda request: graph_generator.render_spec_graph(match_template(request), profile), templated, repeat
+        )
+        results['stages']['template'] = dict(percentiles(samples), image_bytes=image_stats(images))
+
+    unique_codes = list(dict.fromkeys(codes))
+    samples, images = time_stage(
+        lambda code: graph_generator.execute_graph_code(code, "benchmark", profile), unique_codes, repeat
+    )
+    results['stages']['execute_graph_code'] = dict(percentiles(samples), image_bytes=image_stats(images))
+
+    samples, images = time_stage(
+        lambda code: safe_executor.safe_execute_graph_code(code, profile), unique_codes, repeat
+    )
+    results['stages']['safe_execute_graph_code'] = dict(percentiles(samples), image_bytes=image_stats(images))
+
+    samples, images = time_stage(
+        lambda request: graph_generator.generate_roi_graph(request, profile), corpus, repeat
+    )
+    results['stages']['generate_roi_graph'] = dict(percentiles(samples), image_bytes=image_stats(images))
+
+    generator = SafeGraphGenerator(use_docker=use_docker, use_processes=use_processes)
+    samples, images = time_stage(lambda request: generator.generate_roi_graph(request, profile), corpus, repeat)
+    if use_docker:
+        stage_name = 'safe_graph_generator_docker'
+    elif use_processes:
+        stage_name = 'safe_graph_generator_processes'
+    else:
+        stage_name = 'safe_graph_generator_local'
+    results['stages'][stage_name] = dict(percentiles(samples), image_bytes=image_stats(images))
+
+    # End-to-end throughput at each concurrency level
+    jobs = corpus * repeat
+    for level in concurrency_levels:
+        latencies = []
+        images = []
+
+        def timed(request):
+            start = time.perf_counter()
+            images.append(graph_generator.generate_roi_graph(request, profile))
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            list(pool.map(timed, jobs))
+        wall = time.perf_counter() - start
+        results['throughput'][str(level)] = dict(
+            percentiles(latencies),
+            requests=len(jobs),
+            wall_s=round(wall, 3),
+            requests_per_s=round(len(jobs) / wall, 2),
+            image_bytes=image_stats(images)
+        )
+
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def compare(current, baseline):
+    """Print p50 changes per stage against an earlier run"""
+    print(f"Comparing {current.get('commit')} against {baseline.get('commit')}")
+    for section in ('stages', 'throughput'):
+        for name, stats in current.get(section, {}).items():
+            old = baseline.get(section, {}).get(name)
+            if not old or not old.get('p50_ms') or 'p50_ms' not in stats:
+                continue
+            change = (stats['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100
+            flag = "⚠️ " if change > 10 else "   "
+            print(f"{flag}{section}/{name}: p50 {old['p50_ms']}ms -> {stats['p50_ms']}ms ({change:+.1f}%)")
+    print(f"   peak RSS: {baseline.get('peak_rss_mb')}MB -> {current.get('peak_rss_mb')}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the ROI graph pipeline")
+    parser.add_argument('--corpus', help="JSONL or text file of requests (default: built-in prompts)")
+    parser.add_argument('--recordings', help="JSON file mapping request text to recorded LLM output")
+    parser.add_argument('--limit', type=int, default=0, help="Only use the first N requests")
+    parser.add_argument('--repeat', type=int, default=1, help="Times to replay the corpus per stage")
+    parser.add_argument('--concurrency', default="1,2,4", help="Comma-separated concurrency levels")
+    parser.add_argument('--profile', default=None, help="Render profile (default: ROI_RENDER_PROFILE)")
+    parser.add_argument('--llm-latency-ms', type=float, default=0, help="Simulated LLM latency")
+    parser.add_argument('--with-caches', action='store_true', help="Keep code and render caches enabled")
+    parser.add_argument('--templates', action='store_true', help="Let templated requests skip the LLM in end-to-end stages")
+    parser.add_argument('--docker', action='store_true', help="Benchmark the Docker renderer pool too")
+    parser.add_argument('--processes', action='store_true', help="Benchmark the render process pool too (unsandboxed; needs ROI_ALLOW_UNSANDBOXED_RENDERS=true)")
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    parser.add_argument('--compare', help="Earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    # Keep per-request INFO logs out of the timings and the report
+    logging.basicConfig(level=logging.WARNING)
+
+    # Caches would turn every repeat into a hit; measure the real work unless asked
+    if not args.with_caches:
+        os.environ["GRAPH_CODE_CACHE_SIZE"] = "0"
+        os.environ["GRAPH_CODE_CACHE_DB"] = ""
+        os.environ["GRAPH_SEMANTIC_CACHE_SIZE"] = "0"
+        os.environ["ROI_RENDER_CACHE_MAX_MB"] = "0"
+    os.environ.setdefault("LLM_ROUTING", "false")
+    os.environ["ROI_TEMPLATES"] = "true" if args.templates else "false"
+
+    corpus = load_corpus(args.corpus) if args.corpus else list(DEFAULT_CORPUS)
+    if args.limit:
+        corpus = corpus[:args.limit]
+    recordings = None
+    if args.recordings:
+        with open(args.recordings) as f:
+            recordings = json.load(f)
+
+    install_stub_llm(args.llm_latency_ms, recordings)
+
+    import_start = time.perf_counter()
+    import graph_generator  # noqa: F401  (import cost is part of the report)
+    import_seconds = time.perf_counter() - import_start
+
+    concurrency_levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    report = {
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'corpus_size': len(corpus),
+        'repeat': args.repeat,
+        'profile': args.profile or os.environ.get("ROI_RENDER_PROFILE"),
+        'llm_latency_ms': args.llm_latency_ms,
+        'caches': args.with_caches,
+        'templates': args.templates,
+        'import_ms': round(import_seconds * 1000, 1),
+    }
+    report.update(run_benchmark(corpus, args.repeat, concurrency_levels, args.profile, args.docker, args.processes))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+        print(f"📁 Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
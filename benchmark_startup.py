@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark for the ROI bot
+Measures, in fresh interpreters, the import cost of each module the bot loads and
+how long the web tier takes to answer /health after a cold start
+
+Usage:
+    python benchmark_startup.py --output startup.json
+    python benchmark_startup.py --compare startup.json
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+from benchmark_graph_pipeline import git_commit
+
+# Web tier first, then the generation stack it loads lazily
+DEFAULT_MODULES = [
+    'flask', 'slack_bolt', 'job_queue', 'job_store', 'slack_dedup', 'admission', 'metrics', 'render_profiles',
+    'numpy', 'pandas', 'matplotlib.pyplot', 'openai', 'graph_generator',
+]
+
+# Loads the web tier the way application.py does and times the first /health request
+COLD_START_SCRIPT = """
+import time
+start = time.perf_counter()
+import importlib.util
+spec = importlib.util.spec_from_file_location("roi_slackbot", "roi-slackbot.py")
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+loaded = time.perf_counter()
+response = module.flask_app.test_client().get("/health")
+assert response.status_code == 200
+print(loaded - start, time.perf_counter() - start)
+"""
+
+
+def child_env():
+    # No Slack credentials (no network on startup) and no background preload skewing the timings
+    env = dict(os.environ, SLACK_BOT_TOKEN="", SLACK_SIGNING_SECRET="", ROI_PRELOAD_GENERATOR="false")
+    env.pop('PYTHONPROFILEIMPORTTIME', None)
+    return env
+
+
+def import_cost(module):
+    """Cumulative import time of one module in a fresh interpreter, in seconds"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, env=child_env(), timeout=120
+    )
+    if result.returncode != 0:
+        raise Exception(f"Importing {module} failed: {result.stderr.strip().splitlines()[-1]}")
+    # The last line of -X importtime output is the top-level module, with its cumulative time
+    for line in reversed(result.stderr.splitlines()):
+        if line.startswith('import time:') and line.rsplit('|', 1)[-1].strip() == module:
+            return int(line.split('|')[1]) / 1e6
+    raise Exception(f"No import timing found for {module}")
+
+
+def cold_start():
+    """(module load seconds, seconds until /health answers) for the web tier"""
+    result = subprocess.run(
+        [sys.executable, '-c', COLD_START_SCRIPT],
+        capture_output=True, text=True, env=child_env(), timeout=120
+    )
+    if result.returncode != 0:
+        raise Exception(f"Cold start failed: {result.stderr.strip()[-500:]}")
+    load_seconds, health_seconds = result.stdout.split()[-2:]
+    return float(load_seconds), float(health_seconds)
+
+
+def summarize(samples):
+    return {
+        'median_ms': round(statistics.median(samples) * 1000, 1),
+        'min_ms': round(min(samples) * 1000, 1),
+        'max_ms': round(max(samples) * 1000, 1),
+    }
+
+
+def run_benchmark(modules, repeat):
+    results = {'imports': {}, 'cold_start': {}}
+    for module in modules:
+        try:
+            results['imports'][module] = summarize([import_cost(module) for _ in range(repeat)])
+        except Exception as e:
+            results['imports'][module] = {'error': str(e)}
+
+    runs = [cold_start() for _ in range(repeat)]
+    results['cold_start']['module_load'] = summarize([load for load, _ in runs])
+    results['cold_start']['first_health'] = summarize([health for _, health in runs])
+    return results
+
+
+def compare(current, baseline):
+    """Print median changes against an earlier run"""
+    print(f"Comparing {current.get('commit')} against {baseline.get('commit')}")
+    for section in ('cold_start', 'imports'):
+        for name, stats in current.get(section, {}).items():
+            old = baseline.get(section, {}).get(name)
+            if not old or not old.get('median_ms') or 'median_ms' not in stats:
+                continue
+            change = (stats['median_ms'] - old['median_ms']) / old['median_ms'] * 100
+            flag = "⚠️ " if change > 10 else "   "
+            print(f"{flag}{section}/{name}: {old['median_ms']}ms -> {stats['median_ms']}ms ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup-time benchmark for the ROI bot")
+    parser.add_argument('--modules', help="Comma-separated modules to time (default: web tier and generation stack)")
+    parser.add_argument('--repeat', type=int, default=3, help="Fresh interpreters per measurement")
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    parser.add_argument('--compare', help="Earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    # Children import the bot's modules by name and load roi-slackbot.py by path
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    modules = [m.strip() for m in args.modules.split(',') if m.strip()] if args.modules else DEFAULT_MODULES
+    report = {
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'repeat': args.repeat,
+    }
+    report.update(run_benchmark(modules, max(1, args.repeat)))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+        print(f"📁 Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Structured chart specs: a compact JSON description of an ROI line graph
+Specs are validated, hashable and rendered deterministically without exec
+"""
+
+import io
+import re
+import json
+import logging
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.ticker import FuncFormatter
+
+logger = logging.getLogger(__name__)
+
+# Limits that keep specs small and renders cheap
+MAX_PERIODS = 60
+MAX_SERIES = 8
+MAX_TEXT_LENGTH = 120
+
+ALLOWED_UNITS = ('%', '$', '')
+ALLOWED_MARKERS = ('o', 's', '^', 'D', 'v', '')
+
+# Professional palette used when a series has no color
+DEFAULT_COLORS = ['#2E86AB', '#A23B72', '#F18F01', '#3B1F2B', '#6A994E', '#5C5D8D', '#C73E1D', '#7D8491']
+
+HEX_COLOR = re.compile(r'^#[0-9a-fA-F]{6}$')
+
+
+class ChartSpecError(ValueError):
+    """Raised when a chart spec is malformed"""
+
+
+def _text(spec, field, default=''):
+    value = spec.get(field, default)
+    if value is None:
+        value = default
+    if not isinstance(value, str):
+        raise ChartSpecError(f"'{field}' must be a string")
+    return value.strip()[:MAX_TEXT_LENGTH]
+
+
+def validate_chart_spec(spec):
+    """Check a spec and return a normalized copy. Raises ChartSpecError if invalid."""
+    if not isinstance(spec, dict):
+        raise ChartSpecError("Chart spec must be a JSON object")
+
+    periods = spec.get('periods')
+    if not isinstance(periods, list) or not 1 <= len(periods) <= MAX_PERIODS:
+        raise ChartSpecError(f"'periods' must be a list of 1-{MAX_PERIODS} labels")
+    periods = [str(p)[:MAX_TEXT_LENGTH] for p in periods]
+
+    series_list = spec.get('series')
+    if not isinstance(series_list, list) or not 1 <= len(series_list) <= MAX_SERIES:
+        raise ChartSpecError(f"'series' must be a list of 1-{MAX_SERIES} series")
+
+    unit = spec.get('unit', '%')
+    if unit not in ALLOWED_UNITS:
+        raise ChartSpecError(f"'unit' must be one of {ALLOWED_UNITS}")
+
+    normalized_series = []
+    for i, series in enumerate(series_list):
+        if not isinstance(series, dict):
+            raise ChartSpecError(f"Series {i} must be an object")
+
+        values = series.get('values')
+        if not isinstance(values, list) or len(values) != len(periods):
+            raise ChartSpecError(f"Series {i} must have exactly {len(periods)} values")
+        if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            raise ChartSpecError(f"Series {i} values must be numbers")
+
+        color = series.get('color') or DEFAULT_COLORS[i % len(DEFAULT_COLORS)]
+        if not HEX_COLOR.match(color):
+            raise ChartSpecError(f"Series {i} color must look like #RRGGBB")
+
+        marker = series.get('marker', 'o')
+        if marker not in ALLOWED_MARKERS:
+            raise ChartSpecError(f"Series {i} marker must be one of {ALLOWED_MARKERS}")
+
+        normalized_series.append({
+            'label': _text(series, 'label', f'Series {i + 1}'),
+            'values': [round(float(v), 4) for v in values],
+            'color': color.upper(),
+            'marker': marker,
+        })
+
+    return {
+        'title': _text(spec, 'title', 'ROI Analysis'),
+        'x_label': _text(spec, 'x_label', 'Time Period'),
+        'y_label': _text(spec, 'y_label', 'ROI (%)'),
+        'unit': unit,
+        'periods': periods,
+        'series': normalized_series,
+        'show_values': bool(spec.get('show_values', len(normalized_series) == 1)),
+    }
+
+
+def parse_chart_spec(text):
+    """Parse LLM output (optionally wrapped in markdown fences) into a validated spec"""
+    text = text.strip()
+    if "```" in text:
+        text = text.split("```")[1]
+        if text.startswith("json"):
+            text = text[4:]
+    try:
+        spec = json.loads(text)
+    except ValueError as e:
+        raise ChartSpecError(f"Chart spec is not valid JSON: {str(e)}")
+    return validate_chart_spec(spec)
+
+
+def canonical_spec(spec):
+    """Stable JSON text for hashing a validated spec"""
+    return json.dumps(spec, sort_keys=True, separators=(',', ':'))
+
+
+def _format_value(value, unit):
+    if unit == '%':
+        return f'{value:g}%'
+    if unit == '$':
+        return f'${value:,.0f}'
+    return f'{value:g}'
+
+
+def render_chart_spec(spec, dpi=300, figsize=(12, 8), image_format='png'):
+    """Render a validated spec to image bytes using its own Figure (no pyplot state)"""
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+
+    x = list(range(len(spec['periods'])))
+    for series in spec['series']:
+        ax.plot(
+            x, series['values'],
+            marker=series['marker'] or None,
+            linewidth=3,
+            markersize=8,
+            label=series['label'],
+            color=series['color']
+        )
+        if spec['show_values']:
+            for i, v in enumerate(series['values']):
+                ax.annotate(
+                    _format_value(v, spec['unit']), (i, v),
+                    textcoords='offset points', xytext=(0, 8),
+                    ha='center', va='bottom', fontweight='bold'
+                )
+
+    ax.set_xticks(x)
+    ax.set_xticklabels(spec['periods'])
+    ax.yaxis.set_major_formatter(FuncFormatter(lambda v, _: _format_value(v, spec['unit'])))
+
+    ax.set_title(spec['title'], fontsize=18, fontweight='bold', pad=20)
+    ax.set_xlabel(spec['x_label'], fontsize=14)
+    ax.set_ylabel(spec['y_label'], fontsize=14)
+    if len(spec['series']) > 1:
+        ax.legend(fontsize=12)
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=image_format, dpi=dpi, bbox_inches='tight')
+    return buffer.getvalue()
@@ -0,0 +1,174 @@
+"""
+Content-addressed cache for LLM-generated graph code
+In-memory LRU tier with TTL, plus an optional SQLite tier that survives restarts
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_request(text):
+    """Casefold, drop punctuation and collapse whitespace so trivial variations share a key"""
+    text = text.casefold()
+    # \w keeps letters of every script, so non-Latin requests don't all normalize to ''
+    text = re.sub(r"[^\w%$.]+", " ", text)
+    text = re.sub(r"(?<![0-9])\.|\.(?![0-9])", " ", text)
+    return " ".join(text.split())
+
+
+def make_cache_key(user_request, model, temperature, system_prompt):
+    """Hash of everything that determines the LLM output, or None if the request has nothing to key on"""
+    request = normalize_request(user_request)
+    if not request:
+        return None
+    key_data = {
+        'request': request,
+        'model': model,
+        'temperature': temperature,
+        'system_prompt': hashlib.sha256(system_prompt.encode('utf-8')).hexdigest(),
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class GraphCodeCache:
+    """Two-tier cache of generated code keyed by make_cache_key()"""
+
+    def __init__(self, max_entries=256, ttl_seconds=86400, db_path=None, max_disk_entries=5000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._memory = OrderedDict()  # key -> (code, created_at)
+        self._lock = threading.Lock()
+        self._db = None
+
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS graph_code ("
+                    "key TEXT PRIMARY KEY, code TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                self._db.commit()
+                logger.info(f"Graph code disk cache enabled at {db_path}")
+            except sqlite3.Error as e:
+                logger.error(f"Could not open graph code cache database: {str(e)}")
+                self._db = None
+
+    def _expired(self, created_at):
+        return self.ttl_seconds and time.time() - created_at > self.ttl_seconds
+
+    def get(self, key):
+        """Return cached code or None (always None for a None key)"""
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                code, created_at = entry
+                if not self._expired(created_at):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return code
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db_get(key)
+                if row is not None and not self._expired(row[1]):
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def set(self, key, code):
+        if key is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, code, now)
+            if self._db is not None:
+                self._db_set(key, code, now)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM graph_code")
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"Graph code cache clear failed: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._memory),
+            }
+
+    def _remember(self, key, code, created_at):
+        self._memory[key] = (code, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _db_get(self, key):
+        try:
+            return self._db.execute(
+                "SELECT code, created_at FROM graph_code WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Graph code cache read failed: {str(e)}")
+            return None
+
+    def _db_set(self, key, code, created_at):
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO graph_code (key, code, created_at) VALUES (?, ?, ?)",
+                (key, code, created_at)
+            )
+            # Keep the disk tier bounded: drop the oldest rows past the limit
+            self._db.execute(
+                "DELETE FROM graph_code WHERE key IN ("
+                "SELECT key FROM graph_code ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,)
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Graph code cache write failed: {str(e)}")
+
+
+_code_cache = None
+_code_cache_lock = threading.Lock()
+
+
+def get_code_cache():
+    """Return the process-wide graph code cache, configured from the environment"""
+    global _code_cache
+    with _code_cache_lock:
+        if _code_cache is None:
+            _code_cache = GraphCodeCache(
+                max_entries=int(os.environ.get("GRAPH_CODE_CACHE_SIZE", 256)),
+                ttl_seconds=int(os.environ.get("GRAPH_CODE_CACHE_TTL", 86400)),
+                db_path=os.environ.get("GRAPH_CODE_CACHE_DB") or None
+            )
+        return _code_cache
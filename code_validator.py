@@ -0,0 +1,232 @@
+"""
+Pre-execution checks for LLM-generated graph code
+Parses the code once, checks it against an allow-list of imports and calls,
+and caches the compiled code object (or the rejection) by source hash
+"""
+
+import os
+import ast
+import builtins
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Modules generated code may import
+ALLOWED_MODULES = ('matplotlib', 'pandas', 'numpy', 'math', 'datetime')
+
+# Builtins generated code may use; exec gets only these (see exec_builtins)
+ALLOWED_BUILTINS = frozenset((
+    'print', 'len', 'range', 'enumerate', 'zip', 'min', 'max', 'sum', 'abs', 'round',
+    'int', 'float', 'str', 'list', 'dict', 'tuple', 'set', 'bool', 'sorted', 'reversed',
+    'map', 'filter', 'any', 'all', 'isinstance', 'format',
+    'Exception', 'ValueError', 'TypeError',
+))
+
+# Names the exec environment already provides
+PROVIDED_NAMES = frozenset(('plt', 'matplotlib', 'np', 'numpy', 'pd', 'pandas'))
+
+# Methods that touch files, the network or global matplotlib config
+FORBIDDEN_ATTRIBUTES = frozenset((
+    'system', 'popen', 'load', 'loadtxt', 'genfromtxt', 'fromfile', 'tofile', 'save',
+    'savez', 'savez_compressed', 'savetxt', 'memmap', 'to_csv', 'to_excel', 'to_pickle',
+    'to_json', 'to_parquet', 'to_html', 'to_sql', 'rc_file', 'imsave', 'imread',
+))
+
+# Modules that plotting libraries import and expose as attributes ('matplotlib.subprocess', 'np.os')
+UNSAFE_MODULE_NAMES = frozenset((
+    'os', 'sys', 'subprocess', 'shutil', 'importlib', 'builtins', 'pathlib', 'socket', 'ctypes',
+    'pickle', 'tempfile',
+))
+
+# matplotlib's process-wide settings; a change would leak into every later render
+GLOBAL_CONFIG_NAMES = frozenset((
+    'rcParams', 'rcParamsDefault', 'rcParamsOrig', 'rc', 'rcdefaults', 'rc_context', 'rc_file_defaults', 'style',
+))
+
+OUTPUT_NAME = 'output.png'
+
+
+def exec_builtins():
+    """__builtins__ for exec'ing validated code: the allow-list only, plus class support"""
+    allowed = {name: getattr(builtins, name) for name in ALLOWED_BUILTINS}
+    allowed['__build_class__'] = builtins.__build_class__
+    return allowed
+
+
+class CodeValidationError(Exception):
+    """Raised when generated code fails the pre-execution checks"""
+
+
+def _bound_names(tree):
+    """Every name the code itself defines: assignments, defs, imports, loop and lambda targets"""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.alias):
+            names.add((node.asname or node.name).split('.')[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+    return names
+
+
+def _saves_output(call):
+    if call.args:
+        target = call.args[0]
+    else:
+        target = next((kw.value for kw in call.keywords if kw.arg == 'fname'), None)
+    return (isinstance(target, ast.Constant) and isinstance(target.value, str)
+            and os.path.basename(target.value) == OUTPUT_NAME)
+
+
+def check_graph_code(tree):
+    """
+    Check a parsed module against the allow-lists.
+    Returns (ok, reason).
+    """
+    callable_names = ALLOWED_BUILTINS | PROVIDED_NAMES | _bound_names(tree)
+    has_savefig = False
+    saves_output = False
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name.split('.')[0] not in ALLOWED_MODULES:
+                    return False, f"import of '{alias.name}' is not allowed"
+                if GLOBAL_CONFIG_NAMES.intersection(alias.name.split('.')):
+                    return False, f"import of '{alias.name}' is not allowed"
+        elif isinstance(node, ast.ImportFrom):
+            if node.level or (node.module or '').split('.')[0] not in ALLOWED_MODULES:
+                return False, f"import from '{node.module}' is not allowed"
+            if GLOBAL_CONFIG_NAMES.intersection((node.module or '').split('.')):
+                return False, f"import from '{node.module}' is not allowed"
+            for alias in node.names:
+                if alias.name in GLOBAL_CONFIG_NAMES:
+                    return False, f"import of '{alias.name}' is not allowed"
+        elif isinstance(node, ast.Attribute):
+            if node.attr.startswith('_'):
+                return False, f"access to '{node.attr}' is not allowed"
+            if node.attr in FORBIDDEN_ATTRIBUTES:
+                return False, f"call to '{node.attr}' is not allowed"
+            if node.attr in UNSAFE_MODULE_NAMES:
+                return False, f"access to '{node.attr}' is not allowed"
+            if node.attr in GLOBAL_CONFIG_NAMES:
+                return False, f"changing matplotlib's global '{node.attr}' is not allowed"
+        elif isinstance(node, ast.Name) and node.id.startswith('__'):
+            return False, f"use of '{node.id}' is not allowed"
+        elif (isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)
+              and hasattr(builtins, node.id) and node.id not in ALLOWED_BUILTINS):
+            # Any reference, not just a call: 'f = eval; f(...)' must fail too
+            return False, f"use of '{node.id}' is not allowed"
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            return False, "global and nonlocal statements are not allowed"
+        elif isinstance(node, ast.Call):
+            func = node.func
+            if isinstance(func, ast.Name) and func.id not in callable_names:
+                return False, f"call to '{func.id}' is not allowed"
+            if isinstance(func, ast.Attribute) and func.attr == 'savefig':
+                has_savefig = True
+                saves_output = saves_output or _saves_output(node)
+
+    if not has_savefig:
+        return False, "no savefig call"
+    if not saves_output:
+        return False, f"does not save to {OUTPUT_NAME}"
+    return True, "ok"
+
+
+class CompiledCodeCache:
+    """LRU of source hash -> compiled code object, or the reason the code was rejected"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def compile(self, python_code):
+        """Return the code object for python_code. Raises CodeValidationError if it fails the checks."""
+        key = hashlib.sha256(python_code.encode('utf-8')).hexdigest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is None:
+            entry = self._build(python_code)
+            with self._lock:
+                self.misses += 1
+                if not entry[0]:
+                    self.rejected += 1
+                if self.max_entries > 0:
+                    self._entries[key] = entry
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+
+        ok, result = entry
+        if not ok:
+            raise CodeValidationError(result)
+        return result
+
+    def _build(self, python_code):
+        try:
+            tree = ast.parse(python_code, '<graph_code>')
+        except SyntaxError as e:
+            return False, f"syntax error on line {e.lineno}: {e.msg}"
+        ok, reason = check_graph_code(tree)
+        if not ok:
+            return False, reason
+        try:
+            return True, compile(tree, '<graph_code>', 'exec')
+        except (SyntaxError, ValueError) as e:
+            return False, f"does not compile: {str(e)}"
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'rejected': self.rejected,
+                'entries': len(self._entries),
+            }
+
+
+_compiled_cache = None
+_compiled_cache_lock = threading.Lock()
+
+
+def get_compiled_cache():
+    """Return the process-wide compiled code cache"""
+    global _compiled_cache
+    with _compiled_cache_lock:
+        if _compiled_cache is None:
+            _compiled_cache = CompiledCodeCache(
+                max_entries=int(os.environ.get("GRAPH_COMPILED_CACHE_SIZE", 256))
+            )
+        return _compiled_cache
+
+
+def compile_graph_code(python_code):
+    """Validated, compiled code object for python_code (cached). Raises CodeValidationError."""
+    return get_compiled_cache().compile(python_code)
+
+
+def validate_graph_code(python_code):
+    """
+    Dry-run check that code passes the allow-lists, compiles and writes output.png.
+    Returns (ok, reason).
+    """
+    try:
+        compile_graph_code(python_code)
+    except CodeValidationError as e:
+        return False, str(e)
+    return True, "ok"
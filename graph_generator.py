@@ -1,42 +1,218 @@
+import io
 import os
-import tempfile
 import matplotlib
 matplotlib.use('Agg')  # Use non-GUI backend for Heroku
-import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
-from openai import OpenAI
 import logging
 import re
 import json
+import time
+import asyncio
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from code_cache import get_code_cache, make_cache_key, normalize_request
+from semantic_cache import get_semantic_cache
+from llm_client import get_openai_client, call_with_retries, get_async_openai_client, async_call_with_retries
+from model_router import get_model_tiers, generate_with_routing, async_generate_with_routing, get_router_stats
+from render_cache import get_render_cache, render_cache_key
+from chart_spec import parse_chart_spec, canonical_spec, render_chart_spec
+from roi_templates import templates_enabled, match_template, get_template_stats
+from render_context import RenderCapture
+from code_validator import compile_graph_code, get_compiled_cache, exec_builtins, CodeValidationError
+from render_profiles import get_profile, encode_image, record_render, get_render_stats
+from single_flight import SingleFlight
+import metrics
+from metrics import time_stage
 
 logger = logging.getLogger(__name__)
 
-def generate_roi_graph(user_request):
+# Generations currently running, keyed by normalized request
+_in_flight = SingleFlight()
+
+def generate_roi_graph(user_request, profile=None, on_code=None, try_template=True):
     """
     Generate an ROI graph based on user's natural language request
-    Returns path to generated image file
+    Returns the image as bytes, sized and encoded for the render profile
+    on_code(python_code) is called once the LLM code is ready, before the render
+    (not for templates or chart specs, nor for callers that join an in-flight generation)
+    try_template=False skips template matching, for callers that already tried it
+    """
+    profile = get_profile(profile)
+    
+    # Identical requests arriving together share one LLM call and render
+    normalized = normalize_request(user_request)
+    if not normalized:
+        # Nothing to tell such requests apart by, so they don't share
+        return _generate_roi_graph(user_request, profile, on_code, try_template)
+    flight_key = (normalized, profile.name, get_generation_mode())
+    return _in_flight.do(flight_key, lambda: _generate_roi_graph(user_request, profile, on_code, try_template))
+
+# Async generations in flight on the event loop, keyed like _in_flight
+_async_in_flight = {}
+
+async def generate_roi_graph_async(user_request, profile=None, try_template=True):
+    """
+    generate_roi_graph for the asyncio serving mode: the LLM call is awaited
+    and the render runs on the render thread pool, so the event loop never blocks
+    """
+    profile = get_profile(profile)
+    loop = asyncio.get_running_loop()
+    
+    # Spec mode renders natively and cheaply; run the whole sync path off the loop
+    if get_generation_mode() == "spec":
+        return await loop.run_in_executor(None, generate_roi_graph, user_request, profile, None, try_template)
+    
+    normalized = normalize_request(user_request)
+    if not normalized:
+        return await _generate_roi_graph_async(user_request, profile, try_template)
+    flight_key = (normalized, profile.name, get_generation_mode())
+    task = _async_in_flight.get(flight_key)
+    if task is None:
+        task = asyncio.ensure_future(_generate_roi_graph_async(user_request, profile, try_template))
+        _async_in_flight[flight_key] = task
+        task.add_done_callback(lambda _: _async_in_flight.pop(flight_key, None))
+    else:
+        logger.info("Joining in-flight async generation")
+    # Shielded so one caller's cancellation doesn't cancel the shared work
+    return await asyncio.shield(task)
+
+async def _generate_roi_graph_async(user_request, profile, try_template=True):
+    logger.info(f"Generating graph for request: {user_request}")
+    loop = asyncio.get_running_loop()
+    
+    if try_template:
+        image_data = await loop.run_in_executor(get_render_executor(), render_template_graph, user_request, profile)
+        if image_data is not None:
+            return image_data
+    
+    python_code = await get_graph_code_from_llm_async(user_request)
+    image_data = await loop.run_in_executor(
+        get_render_executor(), execute_graph_code, python_code, user_request, profile
+    )
+    logger.info(f"Graph generated successfully ({len(image_data):,} bytes)")
+    return image_data
+
+def generate_roi_graph_preview(user_request, profile=None):
+    """
+    Cheap graph to show while generate_roi_graph runs. Returns (image_data, is_final):
+    a template render is already the final graph; otherwise the fallback graph stands in,
+    and generate_roi_graph returns these same bytes if the LLM fails (pass it
+    try_template=False then, the template was already tried).
     """
+    profile = get_profile(profile)
+    image_data = render_template_graph(user_request, profile)
+    if image_data is not None:
+        return image_data, True
+    # Rendered once per profile, then served from the render cache
+    return execute_graph_code(get_fallback_graph_code(user_request), user_request, profile), False
+
+def _generate_roi_graph(user_request, profile, on_code=None, try_template=True):
     logger.info(f"Generating graph for request: {user_request}")
     
+    # Common request shapes render straight from a template, without the LLM
+    image_data = render_template_graph(user_request, profile) if try_template else None
+    if image_data is not None:
+        return image_data
+    
+    # Structured spec mode: render natively, keeping exec as the fallback
+    if get_generation_mode() == "spec":
+        spec = get_chart_spec_from_llm(user_request)
+        if spec is not None:
+            try:
+                image_data = render_spec_graph(spec, profile)
+                logger.info(f"Graph generated from chart spec ({len(image_data):,} bytes)")
+                return image_data
+            except Exception as e:
+                logger.error(f"Error rendering chart spec: {str(e)}")
+        metrics.FALLBACKS.inc(kind='spec_to_code')
+        logger.warning("Chart spec unavailable, falling back to generated Python code")
+    
     # Get Python code from OpenAI
     python_code = get_graph_code_from_llm(user_request)
     logger.info("Generated Python code from LLM")
+    if on_code is not None:
+        on_code(python_code)
     
-    # Execute the code safely and return image path
-    image_path = execute_graph_code(python_code, user_request)
-    logger.info(f"Graph generated successfully: {image_path}")
+    # Execute the code safely and return the image bytes
+    image_data = execute_graph_code(python_code, user_request, profile)
+    logger.info(f"Graph generated successfully ({len(image_data):,} bytes)")
     
-    return image_path
+    return image_data
 
-def get_graph_code_from_llm(user_request):
-    """Generate Python code using OpenAI to create ROI graph"""
+def _collect_metrics():
+    """Scrape-time metric families for the caches, coalescing, routing and renders"""
+    families = []
+    
+    code_stats = get_code_cache().stats()
+    families.append(("roi_code_cache_lookups_total", "counter", "Graph code cache lookups by result",
+                     [({'result': 'hit'}, code_stats['hits']), ({'result': 'miss'}, code_stats['misses'])]))
+    families.append(("roi_code_cache_entries", "gauge", "Graph code cache entries in memory",
+                     [({}, code_stats['entries'])]))
+    
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is not None:
+        semantic_stats = semantic_cache.stats()
+        families.append(("roi_semantic_cache_lookups_total", "counter", "Similar-request cache lookups by result",
+                         [({'result': 'hit'}, semantic_stats['hits']), ({'result': 'miss'}, semantic_stats['misses'])]))
+        families.append(("roi_semantic_cache_entries", "gauge", "Requests indexed by the similar-request cache",
+                         [({}, semantic_stats['entries'])]))
     
-    # Initialize OpenAI client
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    template_stats = get_template_stats()
+    families.append(("roi_template_lookups_total", "counter", "Requests checked against the template library by result",
+                     [({'result': 'hit'}, template_stats['hits']), ({'result': 'miss'}, template_stats['misses'])]))
+    families.append(("roi_template_hits_total", "counter", "Requests rendered from a template by shape",
+                     [({'shape': shape}, count) for shape, count in template_stats['shapes'].items()]))
     
-    system_prompt = """You are an expert at creating ROI analysis graphs using Python matplotlib.
+    compiled_stats = get_compiled_cache().stats()
+    families.append(("roi_compiled_code_lookups_total", "counter", "Compiled code cache lookups by result",
+                     [({'result': 'hit'}, compiled_stats['hits']), ({'result': 'miss'}, compiled_stats['misses'])]))
+    families.append(("roi_code_rejected_total", "counter", "Generated code rejected before exec",
+                     [({}, compiled_stats['rejected'])]))
+    
+    render_cache = get_render_cache()
+    if render_cache is not None:
+        render_stats = render_cache.stats()
+        families.append(("roi_render_cache_lookups_total", "counter", "Render cache lookups by result",
+                         [({'result': 'hit'}, render_stats['hits']), ({'result': 'miss'}, render_stats['misses'])]))
+        families.append(("roi_render_cache_bytes", "gauge", "Bytes held by the render cache",
+                         [({}, render_stats['bytes'])]))
+    
+    flight_stats = _in_flight.stats()
+    families.append(("roi_generations_in_flight", "gauge", "Generations currently running",
+                     [({}, flight_stats['in_flight'])]))
+    families.append(("roi_generations_coalesced_total", "counter", "Requests that joined an in-flight generation",
+                     [({}, flight_stats['coalesced_total'])]))
+    
+    router_stats = get_router_stats()
+    families.append(("roi_llm_attempts_total", "counter", "LLM code attempts by model and outcome",
+                     [({'model': model, 'outcome': outcome}, stats[outcome])
+                      for model, stats in router_stats.items() for outcome in ('valid', 'invalid', 'errors')]))
+    
+    profile_stats = get_render_stats()
+    families.append(("roi_render_image_bytes_total", "counter", "Bytes of rendered images by profile",
+                     [({'profile': name}, stats['bytes_total']) for name, stats in profile_stats.items()]))
+    return families
+
+metrics.register_collector(_collect_metrics)
+
+def speculative_preview_enabled():
+    """Post generate_roi_graph_preview first and replace it with the full graph when ready"""
+    return os.environ.get("ROI_SPECULATIVE_PREVIEW", "true").lower() in ("1", "true", "yes")
+
+def get_generation_mode():
+    """'code' (LLM writes matplotlib code) or 'spec' (LLM writes a JSON chart spec)"""
+    return os.environ.get("GRAPH_GENERATION_MODE", "code").lower()
+
+# LLM settings; these also form part of the code cache key.
+# Graph code requests pick their models through model_router instead of GRAPH_MODEL.
+GRAPH_MODEL = "gpt-4"
+GRAPH_TEMPERATURE = 0.3
+
+GRAPH_SYSTEM_PROMPT = """You are an expert at creating ROI analysis graphs using Python matplotlib.
 
 Generate clean, professional Python code that creates a line graph based on the user's request.
 
@@ -51,6 +227,7 @@ Requirements:
 8. Include data points on the lines
 9. Add percentage formatting for ROI values when appropriate
 10. Generate realistic time series data (months, quarters, years as appropriate)
+11. Style lines and axes through function arguments; don't change plt.rcParams, plt.rc or plt.style
 
 Example structure:
 ```python
@@ -81,83 +258,382 @@ plt.close()
 
 Generate ONLY the Python code, no explanation or markdown formatting."""
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Create a line graph for: {user_request}"}
-            ],
+CHART_SPEC_SYSTEM_PROMPT = """You are an expert at designing ROI analysis line graphs.
+
+Describe the graph for the user's request as a JSON chart spec. Do not write code.
+
+Requirements:
+1. Create realistic ROI data that makes business sense
+2. Use realistic time periods (months, quarters, years as appropriate), at most 60
+3. Use at most 8 series; every series needs exactly one value per period
+4. "unit" is "%" for percentages, "$" for money, or "" otherwise
+5. Colors are professional #RRGGBB hex values (avoid bright/neon colors)
+6. "marker" is one of "o", "s", "^", "D", "v"
+
+Example:
+{
+  "title": "ROI Comparison: VR vs Traditional Training",
+  "x_label": "Time Period",
+  "y_label": "ROI (%)",
+  "unit": "%",
+  "periods": ["Jan", "Feb", "Mar", "Apr", "May", "Jun"],
+  "series": [
+    {"label": "VR Training ROI", "values": [10, 25, 40, 60, 75, 95], "color": "#2E86AB", "marker": "o"},
+    {"label": "Traditional Training ROI", "values": [5, 8, 12, 15, 18, 20], "color": "#A23B72", "marker": "s"}
+  ],
+  "show_values": false
+}
+
+Generate ONLY the JSON object, no explanation or markdown formatting."""
+
+class LLMBudgetExceeded(Exception):
+    """Raised when a streamed response runs past its wall-clock or token budget"""
+
+def llm_streaming_enabled():
+    return os.environ.get("LLM_STREAMING", "false").lower() in ("1", "true", "yes")
+
+def _call_llm(system_prompt, user_message, stop_at_code_fence=False, model=GRAPH_MODEL):
+    """Send one chat completion request and return the response text"""
+    # Shared client keeps connections alive between requests
+    client = get_openai_client()
+    
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message}
+    ]
+    
+    with time_stage('llm'):
+        if llm_streaming_enabled():
+            return _stream_llm(client, messages, stop_at_code_fence, model)
+        
+        response = call_with_retries(
+            client.chat.completions.create,
+            model=model,
+            messages=messages,
             max_tokens=1500,
-            temperature=0.3
+            temperature=GRAPH_TEMPERATURE
         )
-        
-        python_code = response.choices[0].message.content.strip()
-        
-        # Clean up any markdown formatting
+    
+    return response.choices[0].message.content.strip()
+
+def _closes_code_fence(text):
+    """True once the text holds an opening and a closing ``` fence"""
+    return text.count("```") >= 2
+
+def _stream_llm(client, messages, stop_at_code_fence, model=GRAPH_MODEL):
+    """
+    Stream a completion, stopping as soon as the code fence closes.
+    Raises LLMBudgetExceeded if the wall-clock or token budget runs out first.
+    """
+    time_budget = float(os.environ.get("LLM_TIME_BUDGET_SECONDS", 20))
+    token_budget = int(os.environ.get("LLM_TOKEN_BUDGET", 1500))
+    
+    start = time.monotonic()
+    first_token_at = None
+    tokens = 0
+    finish_reason = None
+    parts = []
+    
+    stream = call_with_retries(
+        client.chat.completions.create,
+        model=model,
+        messages=messages,
+        max_tokens=token_budget,
+        temperature=GRAPH_TEMPERATURE,
+        stream=True,
+        timeout=time_budget  # Also bounds a stall between chunks
+    )
+    
+    try:
+        for chunk in stream:
+            if time.monotonic() - start > time_budget:
+                raise LLMBudgetExceeded(f"LLM response exceeded {time_budget:.0f}s budget")
+            
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            if not choice.delta.content:
+                continue
+            
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+            # Each streamed chunk carries one token
+            tokens += 1
+            if tokens > token_budget:
+                raise LLMBudgetExceeded(f"LLM response exceeded {token_budget} token budget")
+            parts.append(choice.delta.content)
+            
+            if stop_at_code_fence and "`" in choice.delta.content and _closes_code_fence("".join(parts)):
+                finish_reason = "code_fence"
+                break
+    finally:
+        stream.response.close()
+    
+    elapsed = time.monotonic() - start
+    ttfb = (first_token_at - start) if first_token_at else elapsed
+    generation_time = elapsed - ttfb
+    tokens_per_sec = tokens / generation_time if generation_time > 0 else 0.0
+    logger.info(f"LLM stream from {model} finished ({finish_reason}): ttfb={ttfb:.2f}s, "
+                f"tokens={tokens}, tokens/sec={tokens_per_sec:.1f}, total={elapsed:.2f}s")
+    metrics.LLM_TTFB_SECONDS.observe(ttfb, model=model)
+    if tokens:
+        metrics.LLM_TOKENS_PER_SECOND.observe(tokens_per_sec, model=model)
+    
+    if finish_reason == "length":
+        raise LLMBudgetExceeded(f"LLM response exceeded {token_budget} token budget")
+    
+    return "".join(parts).strip()
+
+def _request_graph_code(user_request, model):
+    """Ask one model for graph code and strip any markdown formatting"""
+    python_code = _call_llm(
+        GRAPH_SYSTEM_PROMPT,
+        f"Create a line graph for: {user_request}",
+        stop_at_code_fence=True,
+        model=model
+    )
+    
+    return _extract_code(python_code)
+
+def _extract_code(python_code):
+    """Clean up any markdown formatting around generated code"""
+    with time_stage('code_extraction'):
         if "```python" in python_code:
             python_code = python_code.split("```python")[1].split("```")[0].strip()
         elif "```" in python_code:
             python_code = python_code.split("```")[1].split("```")[0].strip()
-            
+    
+    return python_code
+
+def _graph_code_cache_key(user_request, tiers):
+    return make_cache_key(user_request, ">".join(tiers), GRAPH_TEMPERATURE, GRAPH_SYSTEM_PROMPT)
+
+def get_graph_code_from_llm(user_request):
+    """Generate Python code using OpenAI to create ROI graph"""
+    
+    # Fast model first for simple requests, escalating to the strong model on invalid code
+    tiers = get_model_tiers(user_request)
+    
+    # Serve repeat requests from the code cache
+    code_cache = get_code_cache()
+    cache_key = _graph_code_cache_key(user_request, tiers)
+    cached_code = code_cache.get(cache_key)
+    if cached_code is not None:
+        logger.info("Using cached graph code")
+        return cached_code
+    
+    # Then from code generated for a reworded version of the same request
+    semantic_cache = get_semantic_cache()
+    similar_code = semantic_cache.get(user_request) if semantic_cache is not None else None
+    if similar_code is not None:
+        code_cache.set(cache_key, similar_code)
+        return similar_code
+    
+    try:
+        python_code = generate_with_routing(
+            user_request,
+            tiers,
+            lambda model: _request_graph_code(user_request, model),
+            terminal_errors=(LLMBudgetExceeded,)
+        )
+        
+        # Fallback code is never cached, so a later request can still reach the LLM
+        code_cache.set(cache_key, python_code)
+        if semantic_cache is not None:
+            semantic_cache.set(user_request, python_code)
+        return python_code
+        
+    except Exception as e:
+        logger.error(f"Error calling OpenAI API: {str(e)}")
+        metrics.FALLBACKS.inc(kind='llm_code')
+        # Fallback (also used when a streamed response runs out of budget)
+        return get_fallback_graph_code(user_request)
+
+async def _request_graph_code_async(user_request, model):
+    """_request_graph_code without blocking the event loop (no streaming)"""
+    client = get_async_openai_client()
+    
+    with time_stage('llm'):
+        response = await async_call_with_retries(
+            client.chat.completions.create,
+            model=model,
+            messages=[
+                {"role": "system", "content": GRAPH_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Create a line graph for: {user_request}"}
+            ],
+            max_tokens=1500,
+            temperature=GRAPH_TEMPERATURE
+        )
+    
+    return _extract_code(response.choices[0].message.content.strip())
+
+async def get_graph_code_from_llm_async(user_request):
+    """get_graph_code_from_llm for the asyncio serving mode"""
+    tiers = get_model_tiers(user_request)
+    
+    code_cache = get_code_cache()
+    cache_key = _graph_code_cache_key(user_request, tiers)
+    cached_code = code_cache.get(cache_key)
+    if cached_code is not None:
+        logger.info("Using cached graph code")
+        return cached_code
+    
+    semantic_cache = get_semantic_cache()
+    similar_code = semantic_cache.get(user_request) if semantic_cache is not None else None
+    if similar_code is not None:
+        code_cache.set(cache_key, similar_code)
+        return similar_code
+    
+    try:
+        python_code = await async_generate_with_routing(
+            user_request,
+            tiers,
+            lambda model: _request_graph_code_async(user_request, model),
+            terminal_errors=(LLMBudgetExceeded,)
+        )
+        code_cache.set(cache_key, python_code)
+        if semantic_cache is not None:
+            semantic_cache.set(user_request, python_code)
         return python_code
         
     except Exception as e:
         logger.error(f"Error calling OpenAI API: {str(e)}")
-        # Fallback to a simple default graph
+        metrics.FALLBACKS.inc(kind='llm_code')
         return get_fallback_graph_code(user_request)
 
-def execute_graph_code(python_code, user_request="ROI Analysis"):
+def get_chart_spec_from_llm(user_request):
+    """Ask OpenAI for a JSON chart spec. Returns a validated spec, or None on failure."""
+    
+    # Specs share the code cache; the different system prompt keeps the keys apart
+    code_cache = get_code_cache()
+    cache_key = make_cache_key(user_request, GRAPH_MODEL, GRAPH_TEMPERATURE, CHART_SPEC_SYSTEM_PROMPT)
+    cached_spec = code_cache.get(cache_key)
+    if cached_spec is not None:
+        logger.info("Using cached chart spec")
+        return json.loads(cached_spec)
+    
+    try:
+        spec = parse_chart_spec(_call_llm(CHART_SPEC_SYSTEM_PROMPT, f"Create a chart spec for: {user_request}"))
+    except Exception as e:
+        logger.error(f"Error getting chart spec from OpenAI: {str(e)}")
+        metrics.FALLBACKS.inc(kind='llm_spec')
+        return None
+    
+    code_cache.set(cache_key, canonical_spec(spec))
+    return spec
+
+def render_spec_graph(spec, profile=None):
+    """Render a validated chart spec and return the image bytes"""
+    profile = get_profile(profile)
+    render_cache = get_render_cache()
+    cache_key = render_cache_key(canonical_spec(spec), dict(profile.settings(), renderer='chart_spec'))
+    if render_cache is not None:
+        cached_image = render_cache.get(cache_key)
+        if cached_image is not None:
+            logger.info("Using cached render")
+            return cached_image
+    
+    start = time.monotonic()
+    image_data = encode_image(
+        render_chart_spec(spec, dpi=profile.dpi, figsize=profile.figsize, image_format=profile.savefig_format),
+        profile
+    )
+    record_render(profile, time.monotonic() - start, len(image_data))
+    if render_cache is not None:
+        render_cache.set(cache_key, image_data)
+    return image_data
+
+def render_template_graph(user_request, profile=None):
+    """Render a request that fits a template (see roi_templates), or return None"""
+    if not templates_enabled():
+        return None
+    spec = match_template(user_request)
+    if spec is None:
+        return None
+    try:
+        image_data = render_spec_graph(spec, profile)
+        logger.info(f"Graph generated from template ({len(image_data):,} bytes)")
+        return image_data
+    except Exception as e:
+        logger.error(f"Error rendering template: {str(e)}")
+        metrics.FALLBACKS.inc(kind='template')
+        return None
+
+def execute_graph_code(python_code, user_request="ROI Analysis", profile=None):
     """
-    Safely execute Python code and return path to generated image
+    Safely execute Python code and return the generated image as bytes
     """
-    # Create temp directory for execution
-    with tempfile.TemporaryDirectory() as temp_dir:
-        try:
-            # Set up the execution environment
-            exec_globals = {
-                '__builtins__': __builtins__,
-                'matplotlib': matplotlib,
-                'plt': plt,
-                'pd': pd,
-                'pandas': pd,
-                'np': np,
-                'numpy': np,
-                'os': os,
-                'tempfile': tempfile
-            }
-            
-            # Change working directory for execution
-            original_cwd = os.getcwd()
-            os.chdir(temp_dir)
-            
-            try:
-                # Execute the code
-                exec(python_code, exec_globals)
-                
-                # Check if output.png was created
-                output_path = os.path.join(temp_dir, 'output.png')
-                if not os.path.exists(output_path):
-                    raise Exception("Graph code did not create output.png file")
-                
-                # Copy to a permanent temp location
-                final_temp_file = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-                final_path = final_temp_file.name
-                final_temp_file.close()
-                
-                # Copy the generated image
-                with open(output_path, 'rb') as src, open(final_path, 'wb') as dst:
-                    dst.write(src.read())
-                
-                return final_path
-                
-            finally:
-                os.chdir(original_cwd)
-                
-        except Exception as e:
-            logger.error(f"Error executing graph code: {str(e)}")
-            # Generate a fallback graph
-            return generate_fallback_graph(user_request)
+    profile = get_profile(profile)
+    
+    # Skip exec entirely when this exact code has already been rendered
+    render_cache = get_render_cache()
+    cache_key = render_cache_key(python_code, profile.settings())
+    if render_cache is not None:
+        cached_image = render_cache.get(cache_key)
+        if cached_image is not None:
+            logger.info("Using cached render")
+            return cached_image
+    
+    # Reject code that fails the allow-lists before matplotlib does any work
+    try:
+        with time_stage('validate'):
+            code_object = compile_graph_code(python_code)
+    except CodeValidationError as e:
+        logger.error(f"Graph code rejected: {str(e)}")
+        metrics.FALLBACKS.inc(kind='validation')
+        return generate_fallback_graph(user_request, profile)
+    
+    try:
+        # savefig('output.png') in the generated code is captured in memory
+        start = time.monotonic()
+        capture = RenderCapture(profile)
+        
+        # Set up the execution environment
+        exec_globals = {
+            '__builtins__': capture.builtins(exec_builtins()),
+            'matplotlib': capture.matplotlib,
+            'plt': capture.pyplot,
+            'pd': pd,
+            'pandas': pd,
+            'np': np,
+            'numpy': np
+        }
+        
+        # Execute the code
+        with time_stage('exec'), capture.drawing():
+            exec(code_object, exec_globals)
+        
+        # Check if output.png was saved
+        if capture.image_data is None:
+            raise Exception("Graph code did not save output.png")
+        
+        record_render(profile, time.monotonic() - start, len(capture.image_data))
+        if render_cache is not None:
+            render_cache.set(cache_key, capture.image_data)
+        
+        return capture.image_data
+        
+    except Exception as e:
+        logger.error(f"Error executing graph code: {str(e)}")
+        metrics.FALLBACKS.inc(kind='render')
+        # Generate a fallback graph
+        return generate_fallback_graph(user_request, profile)
+
+# Renders own their figures, so they can run side by side on these threads
+_render_executor = None
+_render_executor_lock = threading.Lock()
+
+def get_render_executor():
+    """Return the process-wide render thread pool (ROI_RENDER_THREADS workers)"""
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is None:
+            _render_executor = ThreadPoolExecutor(
+                max_workers=int(os.environ.get("ROI_RENDER_THREADS", 2)),
+                thread_name_prefix="roi-render"
+            )
+        return _render_executor
 
 def get_fallback_graph_code(user_request):
     """Generate a simple fallback graph when OpenAI fails"""
@@ -185,8 +661,9 @@ plt.savefig('output.png', dpi=300, bbox_inches='tight')
 plt.close()
 """
 
-def generate_fallback_graph(user_request):
+def generate_fallback_graph(user_request, profile=None):
     """Generate a basic fallback graph when code execution fails"""
+    profile = get_profile(profile)
     try:
         # Create a simple ROI graph with guaranteed matching dimensions
         time_periods = ['Q1', 'Q2', 'Q3', 'Q4', 'Q5', 'Q6']
@@ -195,25 +672,27 @@ def generate_fallback_graph(user_request):
         # Ensure arrays have matching dimensions
         assert len(time_periods) == len(roi_data), f"Dimension mismatch: {len(time_periods)} vs {len(roi_data)}"
         
-        plt.figure(figsize=(12, 8))
-        plt.plot(time_periods, roi_data, marker='o', linewidth=3, color='#2E86AB', markersize=8)
-        plt.title(f'ROI Analysis: {user_request[:50]}', fontsize=16, fontweight='bold', pad=20)
-        plt.xlabel('Time Period', fontsize=14)
-        plt.ylabel('ROI (%)', fontsize=14)
-        plt.grid(True, alpha=0.3)
+        # Own figure and canvas, so concurrent fallbacks don't share pyplot state
+        fig = Figure(figsize=profile.figsize)
+        FigureCanvasAgg(fig)
+        ax = fig.subplots()
+        ax.plot(time_periods, roi_data, marker='o', linewidth=3, color='#2E86AB', markersize=8)
+        ax.set_title(f'ROI Analysis: {user_request[:50]}', fontsize=16, fontweight='bold', pad=20)
+        ax.set_xlabel('Time Period', fontsize=14)
+        ax.set_ylabel('ROI (%)', fontsize=14)
+        ax.grid(True, alpha=0.3)
         
         # Add data labels
         for i, v in enumerate(roi_data):
-            plt.text(i, v + 2, f'{v}%', ha='center', va='bottom', fontweight='bold')
+            ax.text(i, v + 2, f'{v}%', ha='center', va='bottom', fontweight='bold')
         
-        plt.tight_layout()
+        fig.tight_layout()
         
-        # Save to temp file
-        temp_file = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-        plt.savefig(temp_file.name, dpi=300, bbox_inches='tight')
-        plt.close()
+        # Save to memory
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=profile.savefig_format, dpi=profile.dpi, bbox_inches='tight')
         
-        return temp_file.name
+        return encode_image(buffer.getvalue(), profile)
         
     except Exception as e:
         logger.error(f"Even fallback graph failed: {str(e)}")
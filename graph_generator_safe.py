@@ -1,112 +1,206 @@
 #!/usr/bin/env python3
 """
-Safe graph generator using Docker containers
+Safe graph generator using Docker containers, or a local process pool
 """
 
 import os
-import json
+import sys
+import base64
+import atexit
 import subprocess
-import tempfile
 import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from dotenv import load_dotenv
+from renderer_pool import RendererPool
 
 # Load environment variables
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Warm renderer pool shared by every SafeGraphGenerator in this process
+_renderer_pool = None
+_renderer_pool_lock = threading.Lock()
+
+def docker_worker_command(name, docker_image="roi-graph-generator"):
+    """Command for one long-lived sandboxed renderer container"""
+    return [
+        'docker', 'run',
+        '--rm',  # Remove container after execution
+        '-i',  # Keep stdin open for the request pipe
+        f'--name={name}',
+        '--network=none',  # No network access
+        '--memory=512m',  # Limit memory to 512MB
+        '--cpus=1',  # Limit to 1 CPU core
+        '--user=1000:1000',  # Run as non-root user
+        '--read-only',  # Read-only filesystem
+        '--tmpfs=/tmp:rw,size=100m',  # Temporary writable space
+        docker_image,
+        'python3', 'safe_executor.py', '--serve'
+    ]
+
+def kill_docker_worker(name):
+    """Force-remove a renderer container whose worker timed out"""
+    subprocess.run(['docker', 'kill', name], capture_output=True, timeout=30)
+
+def get_renderer_pool(docker_image="roi-graph-generator", pool_size=None):
+    """Return the process-wide renderer pool, creating it on first use"""
+    global _renderer_pool
+    with _renderer_pool_lock:
+        if _renderer_pool is None:
+            _renderer_pool = RendererPool(
+                lambda name: docker_worker_command(name, docker_image),
+                size=pool_size,
+                on_kill=kill_docker_worker
+            )
+        return _renderer_pool
+
+def shutdown_renderer_pool():
+    """Stop all warm renderer workers"""
+    global _renderer_pool
+    with _renderer_pool_lock:
+        if _renderer_pool is not None:
+            _renderer_pool.shutdown()
+            _renderer_pool = None
+
+atexit.register(shutdown_renderer_pool)
+
+# Render processes for deployments without Docker. Not a sandbox: generated code runs
+# on the host with only the code validator and rlimits in its way, so it is opt-in
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def get_process_pool(pool_size=None):
+    """Return the process-wide render process pool, creating it on first use"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            from safe_executor import init_process_worker
+            
+            workers = pool_size or int(os.environ.get("ROI_PROCESS_POOL_SIZE", os.cpu_count() or 2))
+            options = {}
+            if sys.version_info >= (3, 11):
+                # Recycle workers like the Docker pool does (not supported before 3.11)
+                options['max_tasks_per_child'] = int(os.environ.get("ROI_RENDER_MAX_JOBS", 50))
+            # Spawned, not forked, so workers don't inherit the web process's threads and locks
+            _process_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_process_worker,
+                **options
+            )
+            logger.info(f"Started render process pool with {workers} workers")
+        return _process_pool
+
+def shutdown_process_pool(wait=True):
+    """Stop the render process pool"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=wait, cancel_futures=True)
+            _process_pool = None
+
+atexit.register(shutdown_process_pool)
+
+def unsandboxed_renders_allowed():
+    return os.environ.get("ROI_ALLOW_UNSANDBOXED_RENDERS", "false").lower() in ("1", "true", "yes")
+
 class SafeGraphGenerator:
-    def __init__(self, use_docker=True):
+    def __init__(self, use_docker=True, pool_size=None, use_processes=False):
+        if use_processes and not use_docker and not unsandboxed_renders_allowed():
+            raise Exception("The process render backend runs generated code unsandboxed on this host; "
+                            "set ROI_ALLOW_UNSANDBOXED_RENDERS=true to use it")
         self.use_docker = use_docker
+        self.use_processes = use_processes
         self.docker_image = "roi-graph-generator"
+        self.pool_size = pool_size
         
-    def generate_roi_graph(self, user_request):
+    def generate_roi_graph(self, user_request, profile=None):
         """
         Generate an ROI graph using containerized execution
-        Returns path to generated image file
+        Returns the image as bytes, sized and encoded for the render profile
         """
         logger.info(f"Generating graph for request: {user_request}")
         
         if self.use_docker:
-            return self._generate_with_docker(user_request)
+            return self._generate_with_docker(user_request, profile)
+        elif self.use_processes:
+            return self._generate_with_processes(user_request, profile)
         else:
             # Fallback to local execution (less safe)
             from graph_generator import generate_roi_graph as local_generate
-            return local_generate(user_request)
+            return local_generate(user_request, profile)
     
-    def _generate_with_docker(self, user_request):
-        """Generate graph using Docker container"""
+    def _generate_with_docker(self, user_request, profile=None):
+        """Generate graph on a warm Docker renderer worker"""
         try:
-            # Create temporary output file
-            temp_file = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-            temp_path = temp_file.name
-            temp_file.close()
-            
             # Prepare input data
             input_data = {
-                'user_request': user_request
+                'user_request': user_request,
+                'profile': getattr(profile, 'name', profile)
             }
             
-            # Run Docker container
-            cmd = [
-                'docker', 'run',
-                '--rm',  # Remove container after execution
-                '--network=none',  # No network access
-                '--memory=512m',  # Limit memory to 512MB
-                '--cpus=1',  # Limit to 1 CPU core
-                '--user=1000:1000',  # Run as non-root user
-                '--read-only',  # Read-only filesystem
-                '--tmpfs=/tmp:rw,size=100m',  # Temporary writable space
-                '-v', f'{os.path.dirname(temp_path)}:/output:rw',  # Mount output directory
-                self.docker_image,
-                'python3', 'safe_executor.py'
-            ]
-            
-            logger.info(f"Running Docker command: {' '.join(cmd)}")
-            
-            # Execute with timeout
-            process = subprocess.Popen(
-                cmd,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            stdout, stderr = process.communicate(
-                input=json.dumps(input_data),
-                timeout=60  # 60 second timeout
-            )
-            
-            if process.returncode != 0:
-                logger.error(f"Docker execution failed: {stderr}")
-                raise Exception(f"Container execution failed: {stderr}")
-            
-            # Parse response
-            response = json.loads(stdout)
+            pool = get_renderer_pool(self.docker_image, self.pool_size)
+            response = pool.render(input_data, timeout=60)  # 60 second timeout
             
             if response.get('success'):
-                # The container should have created the file at the mounted location
-                container_output_path = response.get('output_path', '/tmp/graph_output.png')
-                expected_local_path = os.path.join(os.path.dirname(temp_path), 'graph_output.png')
-                
-                if os.path.exists(expected_local_path):
-                    # Move to our desired temp file location
-                    os.rename(expected_local_path, temp_path)
-                    logger.info(f"Graph generated successfully: {temp_path}")
-                    return temp_path
-                else:
-                    raise Exception("Container did not create output file")
+                if not response.get('image_b64'):
+                    raise Exception("Container did not return an image")
+                image_data = base64.b64decode(response['image_b64'])
+                logger.info(f"Graph generated successfully ({len(image_data):,} bytes)")
+                return image_data
             else:
                 raise Exception(response.get('error', 'Unknown container error'))
                 
-        except subprocess.TimeoutExpired:
+        except TimeoutError:
             logger.error("Docker execution timed out")
             raise Exception("Graph generation timed out")
         except Exception as e:
             logger.error(f"Docker execution failed: {str(e)}")
             raise Exception(f"Failed to generate graph: {str(e)}")
 
+    def _generate_with_processes(self, user_request, profile=None):
+        """
+        Call the LLM here, then render in a pool process under CPU and memory limits.
+        Unsandboxed: the pool processes run as the bot, with its files and network.
+        """
+        from graph_generator import get_graph_code_from_llm, render_template_graph
+        from safe_executor import render_with_limits
+        
+        # Templates render without exec, so they need no sandbox
+        image_data = render_template_graph(user_request, profile)
+        if image_data is not None:
+            return image_data
+        
+        python_code = get_graph_code_from_llm(user_request)
+        profile_name = getattr(profile, 'name', profile)
+        
+        try:
+            future = get_process_pool(self.pool_size).submit(
+                render_with_limits,
+                python_code,
+                profile_name,
+                cpu_seconds=float(os.environ.get("ROI_RENDER_CPU_SECONDS", 20)),
+                memory_mb=int(os.environ.get("ROI_RENDER_MEMORY_MB", 512))
+            )
+            image_data = future.result(timeout=60)  # 60 second timeout
+        except FutureTimeoutError:
+            logger.error("Render process timed out")
+            raise Exception("Graph generation timed out")
+        except BrokenProcessPool as e:
+            # A worker died mid-job; start a fresh pool for the next request
+            logger.error(f"Render process pool broke: {str(e)}")
+            shutdown_process_pool(wait=False)
+            raise Exception("Failed to generate graph: render worker crashed")
+        
+        if image_data is None:
+            raise Exception("Failed to generate graph")
+        logger.info(f"Graph generated successfully ({len(image_data):,} bytes)")
+        return image_data
+
 def build_docker_image():
     """Build the Docker image for safe execution"""
     try:
@@ -139,7 +233,7 @@ def build_docker_image():
         return False
 
 # Convenience function
-def generate_roi_graph_safe(user_request):
+def generate_roi_graph_safe(user_request, profile=None):
     """Generate ROI graph with containerized safety"""
     generator = SafeGraphGenerator(use_docker=True)
-    return generator.generate_roi_graph(user_request)
+    return generator.generate_roi_graph(user_request, profile)
@@ -0,0 +1,276 @@
+"""
+Background job queue for ROI graph generation
+Slack handlers enqueue jobs and return; worker threads do the slow work
+"""
+
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Job states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted to a queue that is already at max depth"""
+
+
+class RetryJobError(Exception):
+    """Raise from a handler to run the job again later; its checkpoints are kept"""
+
+
+# The job each worker thread is running, for checkpoint()
+_current = threading.local()
+
+
+def current_job():
+    """The Job being handled on this thread, or None outside a job handler"""
+    return getattr(_current, 'job', None)
+
+
+def checkpoint(stage, data=True):
+    """
+    Record that the current job finished a stage, with its artifact.
+    A backend that persists checkpoints lets a resumed job skip finished stages.
+    """
+    job = current_job()
+    if job is None:
+        return
+    job.checkpoints[stage] = data
+    backend = getattr(_current, 'backend', None)
+    if backend is not None and hasattr(backend, 'save_checkpoint'):
+        backend.save_checkpoint(job, stage, data)
+
+
+class Job:
+    """A unit of background work. The payload must stay JSON-serializable."""
+
+    def __init__(self, kind, payload, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.payload = payload
+        self.status = JOB_QUEUED
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.attempts = 0
+        # Stage name -> artifact, see checkpoint()
+        self.checkpoints = {}
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'attempts': self.attempts,
+            'stages': list(self.checkpoints),
+        }
+
+
+class InMemoryJobBackend:
+    """
+    Bounded in-process backend. Jobs are lost when the process exits.
+
+    Any object with the same put/get/update/get_job/depth methods can be
+    passed to JobQueue instead, e.g. job_store.SQLiteJobBackend, which persists
+    jobs and their checkpoints to disk.
+    """
+
+    def __init__(self, max_depth=50, max_history=1000):
+        self.max_depth = max_depth
+        self.max_history = max_history
+        self._pending = queue.Queue(maxsize=max_depth)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, job):
+        with self._lock:
+            try:
+                self._pending.put_nowait(job.id)
+            except queue.Full:
+                raise QueueFullError(f"Job queue is full ({self.max_depth} jobs waiting)")
+            self._jobs[job.id] = job
+            self._trim_history()
+
+    def get(self, timeout=None):
+        """Block until a job is available; returns None on timeout"""
+        try:
+            job_id = self._pending.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def update(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+
+    def get_job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def depth(self):
+        return self._pending.qsize()
+
+    def _trim_history(self):
+        # Forget the oldest finished jobs once we hold more than max_history
+        excess = len(self._jobs) - self.max_history
+        if excess <= 0:
+            return
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].status in (JOB_DONE, JOB_FAILED):
+                del self._jobs[job_id]
+                excess -= 1
+
+
+class JobQueue:
+    """Dispatches queued jobs to registered handlers on a pool of worker threads"""
+
+    def __init__(self, backend=None, worker_count=None, max_depth=None, max_attempts=None):
+        if max_depth is None:
+            max_depth = int(os.environ.get("ROI_QUEUE_MAX_DEPTH", 50))
+        if worker_count is None:
+            worker_count = int(os.environ.get("ROI_WORKER_COUNT", 2))
+        if max_attempts is None:
+            max_attempts = int(os.environ.get("ROI_JOB_MAX_ATTEMPTS", 3))
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = float(os.environ.get("ROI_JOB_RETRY_DELAY", 5))
+
+        self.backend = backend or InMemoryJobBackend(max_depth=max_depth)
+        self.worker_count = max(1, worker_count)
+        self._handlers = {}
+        self._threads = []
+        self._stop_event = threading.Event()
+
+    def register(self, kind, handler):
+        """Register handler(payload) for jobs of the given kind"""
+        self._handlers[kind] = handler
+
+    def submit(self, kind, payload):
+        """Enqueue a job and return it. Raises QueueFullError when at max depth."""
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+
+        job = Job(kind, payload)
+        self.backend.put(job)
+        logger.info(f"Queued {kind} job {job.id} (depth={self.backend.depth()})")
+        return job
+
+    def get_status(self, job_id):
+        """Return the job as a dict, or None if it is unknown"""
+        job = self.backend.get_job(job_id)
+        return job.to_dict() if job else None
+
+    def depth(self):
+        return self.backend.depth()
+
+    def start(self):
+        """Start the worker threads (no-op if already running)"""
+        if self._threads:
+            return
+
+        self._stop_event.clear()
+        for i in range(self.worker_count):
+            thread = threading.Thread(
+                target=self._worker_loop,
+                name=f"roi-worker-{i}",
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+        logger.info(f"Started {self.worker_count} background job workers")
+
+    def stop(self, timeout=5):
+        """Ask workers to exit once their current job finishes"""
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def _worker_loop(self):
+        while not self._stop_event.is_set():
+            job = self.backend.get(timeout=1)
+            if job is None:
+                continue
+            self._run_job(job)
+
+    def is_last_attempt(self, job):
+        return job.attempts >= self.max_attempts
+
+    def _run_job(self, job):
+        handler = self._handlers.get(job.kind)
+
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        job.attempts += 1
+        self.backend.update(job)
+        if job.attempts == 1:
+            STAGE_SECONDS.observe(job.started_at - job.created_at, stage='queue_wait')
+
+        _current.job = job
+        _current.backend = self.backend
+        try:
+            if handler is None:
+                raise Exception(f"No handler registered for job kind '{job.kind}'")
+            handler(job.payload)
+            job.status = JOB_DONE
+        except RetryJobError as e:
+            if self.is_last_attempt(job):
+                logger.error(f"Job {job.id} failed after {job.attempts} attempts: {str(e)}")
+                job.status = JOB_FAILED
+            else:
+                logger.warning(f"Job {job.id} will be retried (attempt {job.attempts}/{self.max_attempts}): {str(e)}")
+                job.status = JOB_QUEUED
+            job.error = str(e)[:500]
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {str(e)}")
+            job.status = JOB_FAILED
+            job.error = str(e)[:500]
+        finally:
+            _current.job = None
+            _current.backend = None
+            job.finished_at = time.time()
+            if job.status == JOB_QUEUED:
+                self._requeue(job)
+            else:
+                self.backend.update(job)
+
+        logger.info(f"Job {job.id} {job.status} in {job.finished_at - job.started_at:.2f}s")
+
+    def _requeue(self, job):
+        # Back off a little longer after each failed attempt
+        delay = self.retry_delay * job.attempts
+        if hasattr(self.backend, 'requeue'):
+            # Saved and queued in one write, so no worker can claim the job before its delay
+            self.backend.requeue(job, delay)
+            return
+        self.backend.update(job)
+        timer = threading.Timer(delay, self._put_retry, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def _put_retry(self, job):
+        try:
+            self.backend.put(job)
+        except QueueFullError:
+            logger.error(f"Job queue full, dropping retry of job {job.id}")
+            job.status = JOB_FAILED
+            self.backend.update(job)
@@ -0,0 +1,250 @@
+"""
+Durable job backend for the background job queue
+Jobs and their stage checkpoints (LLM code, rendered image, upload) live in a SQLite
+database in WAL mode, so a job whose worker died resumes from its last finished stage.
+Several processes (gunicorn workers) can share one database; each claims jobs atomically.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from job_queue import Job, QueueFullError, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS jobs ("
+    "id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL, error TEXT, "
+    "created_at REAL NOT NULL, started_at REAL, finished_at REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+    "owner TEXT, run_after REAL NOT NULL DEFAULT 0)",
+    "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, run_after, created_at)",
+    "CREATE TABLE IF NOT EXISTS job_checkpoints ("
+    "job_id TEXT NOT NULL, stage TEXT NOT NULL, data BLOB, is_json INTEGER NOT NULL, created_at REAL NOT NULL, "
+    "PRIMARY KEY (job_id, stage))",
+    "CREATE TABLE IF NOT EXISTS job_workers (owner TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL)",
+]
+
+
+class SQLiteJobBackend:
+    """
+    JobQueue backend that persists jobs to SQLite.
+    Running jobs belong to the process that claimed them; when that process stops
+    heartbeating for lease_seconds, its jobs are queued again (up to max_attempts).
+    """
+
+    def __init__(self, db_path, max_depth=50, max_attempts=3, lease_seconds=60, retention_seconds=86400,
+                 poll_interval=0.5):
+        self.db_path = db_path
+        self.max_depth = max_depth
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._last_recovery = 0.0
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self._db.execute(statement)
+
+        self._heartbeat()
+        self.recover()
+        thread = threading.Thread(target=self._heartbeat_loop, name="roi-job-heartbeat", daemon=True)
+        thread.start()
+        logger.info(f"Durable job store enabled at {db_path}")
+
+    def _heartbeat(self):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO job_workers (owner, heartbeat_at) VALUES (?, ?)", (self.owner, time.time())
+            )
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(max(1, self.lease_seconds / 3))
+            try:
+                self._heartbeat()
+            except sqlite3.Error as e:
+                logger.error(f"Job store heartbeat failed: {str(e)}")
+
+    def recover(self):
+        """Queue again the jobs of workers that stopped heartbeating, and forget old finished jobs"""
+        now = time.time()
+        self._last_recovery = now
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                live = "SELECT owner FROM job_workers WHERE heartbeat_at > ?"
+                stale = self._db.execute(
+                    f"SELECT id, attempts FROM jobs WHERE status = ? AND (owner IS NULL OR owner NOT IN ({live}))",
+                    (JOB_RUNNING, now - self.lease_seconds)
+                ).fetchall()
+                for job_id, attempts in stale:
+                    if attempts >= self.max_attempts:
+                        self._db.execute(
+                            "UPDATE jobs SET status = ?, error = ?, finished_at = ?, owner = NULL WHERE id = ?",
+                            (JOB_FAILED, "Worker stopped while running the job", now, job_id)
+                        )
+                    else:
+                        self._db.execute(
+                            "UPDATE jobs SET status = ?, owner = NULL, run_after = 0 WHERE id = ?", (JOB_QUEUED, job_id)
+                        )
+                if stale:
+                    logger.warning(f"Recovered {len(stale)} jobs from stopped workers")
+
+                cutoff = now - self.retention_seconds
+                self._db.execute(
+                    "DELETE FROM job_checkpoints WHERE job_id IN "
+                    "(SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?)", (JOB_DONE, JOB_FAILED, cutoff)
+                )
+                self._db.execute(
+                    "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (JOB_DONE, JOB_FAILED, cutoff)
+                )
+                self._db.execute("DELETE FROM job_workers WHERE heartbeat_at < ?", (cutoff,))
+                self._db.execute("COMMIT")
+            except sqlite3.Error:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def put(self, job):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                depth = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (JOB_QUEUED,)).fetchone()[0]
+                if depth >= self.max_depth:
+                    raise QueueFullError(f"Job queue is full ({self.max_depth} jobs waiting)")
+                self._db.execute(
+                    "INSERT INTO jobs (id, kind, payload, status, created_at, attempts) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job.id, job.kind, json.dumps(job.payload), job.status, job.created_at, job.attempts)
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def get(self, timeout=None):
+        """Claim the oldest runnable job; returns None on timeout"""
+        deadline = time.time() + (timeout if timeout is not None else float('inf'))
+        while True:
+            if time.time() - self._last_recovery > self.lease_seconds / 3:
+                try:
+                    self.recover()
+                except sqlite3.Error as e:
+                    logger.error(f"Job recovery failed: {str(e)}")
+
+            job = self._claim()
+            if job is not None:
+                return job
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            # Woken early by put() in this process; other processes' jobs are found by polling
+            with self._wakeup:
+                self._wakeup.wait(min(self.poll_interval, remaining))
+
+    def _claim(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id FROM jobs WHERE status = ? AND run_after <= ? ORDER BY created_at LIMIT 1",
+                    (JOB_QUEUED, time.time())
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE jobs SET status = ?, owner = ? WHERE id = ?", (JOB_RUNNING, self.owner, row[0]))
+                self._db.execute("COMMIT")
+            except sqlite3.Error:
+                self._db.execute("ROLLBACK")
+                raise
+        return self._load(row[0], with_artifacts=True) if row else None
+
+    def _load(self, job_id, with_artifacts=False):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT kind, payload, status, error, created_at, started_at, finished_at, attempts "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            if with_artifacts:
+                checkpoints = self._db.execute(
+                    "SELECT stage, data, is_json FROM job_checkpoints WHERE job_id = ? ORDER BY created_at", (job_id,)
+                ).fetchall()
+            else:
+                checkpoints = [(stage, None, 0) for (stage,) in self._db.execute(
+                    "SELECT stage FROM job_checkpoints WHERE job_id = ? ORDER BY created_at", (job_id,)
+                )]
+
+        kind, payload, status, error, created_at, started_at, finished_at, attempts = row
+        job = Job(kind, json.loads(payload), job_id=job_id)
+        job.status = status
+        job.error = error
+        job.created_at = created_at
+        job.started_at = started_at
+        job.finished_at = finished_at
+        job.attempts = attempts
+        for stage, data, is_json in checkpoints:
+            job.checkpoints[stage] = json.loads(data) if is_json else data
+        return job
+
+    def update(self, job):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, started_at = ?, finished_at = ?, attempts = ? WHERE id = ?",
+                (job.status, job.error, job.started_at, job.finished_at, job.attempts, job.id)
+            )
+
+    def requeue(self, job, delay=0):
+        """Save a job and queue it again after delay seconds, keeping its checkpoints"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, started_at = ?, finished_at = ?, attempts = ?, "
+                "owner = NULL, run_after = ? WHERE id = ?",
+                (JOB_QUEUED, job.error, job.started_at, job.finished_at, job.attempts, time.time() + delay, job.id)
+            )
+
+    def save_checkpoint(self, job, stage, data):
+        # Images and other bytes are stored as they are; anything else as JSON
+        is_json = not isinstance(data, bytes)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO job_checkpoints (job_id, stage, data, is_json, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job.id, stage, json.dumps(data) if is_json else sqlite3.Binary(data), int(is_json), time.time())
+            )
+
+    def get_job(self, job_id):
+        return self._load(job_id)
+
+    def depth(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (JOB_QUEUED,)).fetchone()[0]
+
+
+def get_job_backend():
+    """SQLiteJobBackend when ROI_JOB_DB is set, otherwise None (JobQueue keeps jobs in memory)"""
+    db_path = os.environ.get("ROI_JOB_DB")
+    if not db_path:
+        return None
+    try:
+        return SQLiteJobBackend(
+            db_path,
+            max_depth=int(os.environ.get("ROI_QUEUE_MAX_DEPTH", 50)),
+            max_attempts=int(os.environ.get("ROI_JOB_MAX_ATTEMPTS", 3)),
+            lease_seconds=float(os.environ.get("ROI_JOB_LEASE_SECONDS", 60))
+        )
+    except sqlite3.Error as e:
+        logger.error(f"Could not open job database, keeping jobs in memory: {str(e)}")
+        return None
@@ -0,0 +1,244 @@
+"""
+Process-wide OpenAI client with keep-alive connection pooling and jittered retries
+Safe to share across gunicorn threads and background workers; the async client
+serves the event loop of the ASGI mode
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+# Errors worth retrying: rate limits, 5xx responses and transport failures
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+)
+
+_client = None
+_async_client = None
+_async_client_loop = None
+_transport = None
+_client_lock = threading.Lock()
+# Pending closes of replaced async clients; held so the tasks are not garbage collected
+_closing_tasks = set()
+
+
+def _http_settings():
+    timeout = httpx.Timeout(
+        float(os.environ.get("OPENAI_TIMEOUT_SECONDS", 60)),
+        connect=float(os.environ.get("OPENAI_CONNECT_TIMEOUT_SECONDS", 5))
+    )
+    limits = httpx.Limits(
+        max_connections=int(os.environ.get("OPENAI_MAX_CONNECTIONS", 20)),
+        max_keepalive_connections=int(os.environ.get("OPENAI_MAX_KEEPALIVE", 10)),
+        keepalive_expiry=30
+    )
+    return timeout, limits
+
+
+def _build_client():
+    timeout, limits = _http_settings()
+    http_client = httpx.Client(timeout=timeout, limits=limits, transport=_transport)
+
+    # Retries are handled by call_with_retries so the policy is ours, not the SDK's
+    return OpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY") or ("stub" if _transport else None),
+        http_client=http_client,
+        timeout=timeout,
+        max_retries=0
+    )
+
+
+def get_openai_client():
+    """Return the shared OpenAI client, creating it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = _build_client()
+            logger.info("Created shared OpenAI client")
+        return _client
+
+
+async def _aclose_quietly(client):
+    try:
+        await client.close()
+    except Exception as e:
+        logger.warning(f"Failed to close replaced async OpenAI client: {e}")
+
+
+def _close_async_client(client, client_loop):
+    """
+    Close a replaced AsyncOpenAI client and its connection pool.
+    Runs on the client's own loop while that loop is alive, otherwise on the
+    current loop, or on a throwaway loop when called outside one.
+    """
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    try:
+        if client_loop is not None and client_loop is not running \
+                and client_loop.is_running() and not client_loop.is_closed():
+            asyncio.run_coroutine_threadsafe(_aclose_quietly(client), client_loop)
+        elif running is not None:
+            task = running.create_task(_aclose_quietly(client))
+            _closing_tasks.add(task)
+            task.add_done_callback(_closing_tasks.discard)
+        else:
+            asyncio.run(_aclose_quietly(client))
+    except Exception as e:
+        logger.warning(f"Failed to close replaced async OpenAI client: {e}")
+
+
+def get_async_openai_client():
+    """
+    Return the shared AsyncOpenAI client for the running event loop.
+    Connections belong to one loop, so a new loop gets a new client and the
+    previous one is closed.
+    """
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    old_client = old_loop = None
+    with _client_lock:
+        if _async_client is None or _async_client_loop is not loop:
+            old_client, old_loop = _async_client, _async_client_loop
+            timeout, limits = _http_settings()
+            http_client = httpx.AsyncClient(timeout=timeout, limits=limits, transport=_transport)
+            _async_client = AsyncOpenAI(
+                api_key=os.environ.get("OPENAI_API_KEY") or ("stub" if _transport else None),
+                http_client=http_client,
+                timeout=timeout,
+                max_retries=0
+            )
+            _async_client_loop = loop
+            logger.info("Created shared async OpenAI client")
+        client = _async_client
+    if old_client is not None:
+        _close_async_client(old_client, old_loop)
+    return client
+
+
+def configure_client(transport=None):
+    """
+    Replace the shared clients, e.g. with make_stub_transport() for offline runs.
+    Pass no transport to go back to the real network.
+    """
+    global _client, _async_client, _async_client_loop, _transport
+    with _client_lock:
+        old_client = _client
+        old_async_client, old_async_loop = _async_client, _async_client_loop
+        _transport = transport
+        _client = None
+        _async_client = None
+        _async_client_loop = None
+    if old_client is not None:
+        old_client.close()
+    if old_async_client is not None:
+        _close_async_client(old_async_client, old_async_loop)
+
+
+def _retry_after_seconds(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_delay(error, attempt):
+    """Seconds to wait before retry number attempt + 1, or None to give up"""
+    max_retries = int(os.environ.get("OPENAI_MAX_RETRIES", 3))
+    if attempt >= max_retries:
+        return None
+    delay = _retry_after_seconds(error)
+    if delay is None:
+        base_delay = float(os.environ.get("OPENAI_RETRY_BASE_SECONDS", 0.5))
+        max_delay = float(os.environ.get("OPENAI_RETRY_MAX_SECONDS", 8))
+        delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+    logger.warning(f"OpenAI call failed ({type(error).__name__}), retry {attempt + 1}/{max_retries} in {delay:.2f}s")
+    return delay
+
+
+def call_with_retries(fn, *args, **kwargs):
+    """
+    Call fn, retrying 429/5xx/connection errors with full-jitter exponential backoff.
+    Honours Retry-After when the server sends one.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None:
+                raise
+            attempt += 1
+            time.sleep(delay)
+
+
+async def async_call_with_retries(fn, *args, **kwargs):
+    """call_with_retries for coroutine functions; waits without blocking the event loop"""
+    attempt = 0
+    while True:
+        try:
+            return await fn(*args, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None:
+                raise
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+def make_stub_transport(reply):
+    """
+    Offline transport answering chat completions locally.
+    reply is the response text, or a callable taking the request body dict and returning it.
+    Streaming requests get the text back as server-sent events, a few characters per chunk.
+    """
+    def handler(request):
+        if not request.url.path.endswith("/chat/completions"):
+            return httpx.Response(404, json={"error": {"message": "Not stubbed"}})
+
+        body = json.loads(request.content or b"{}")
+        text = reply(body) if callable(reply) else reply
+        model = body.get("model", "stub")
+
+        if body.get("stream"):
+            events = []
+            for i in range(0, len(text), 4):
+                events.append({
+                    "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": text[i:i + 4]}, "finish_reason": None}]
+                })
+            events.append({
+                "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+            })
+            content = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+            return httpx.Response(200, content=content.encode("utf-8"),
+                                  headers={"content-type": "text/event-stream"})
+
+        return httpx.Response(200, json={
+            "id": "stub", "object": "chat.completion", "created": 0, "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        })
+
+    return httpx.MockTransport(handler)
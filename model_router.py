@@ -0,0 +1,145 @@
+"""
+Tiered model routing for graph code generation
+Simple requests try a fast model first and escalate to the strong model only
+when the generated code fails validation
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from code_validator import validate_graph_code
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAST_MODEL = "gpt-3.5-turbo"
+DEFAULT_STRONG_MODEL = "gpt-4"
+
+# Words that suggest a request needs more than a basic line chart
+COMPLEX_KEYWORDS = (
+    'breakdown', 'scenario', 'sensitivity', 'forecast', 'projection', 'npv', 'irr',
+    'payback', 'cumulative', 'stacked', 'multiple', 'regression', 'confidence',
+    'segment', 'per department', 'by region', 'weighted',
+)
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def routing_enabled():
+    return os.environ.get("LLM_ROUTING", "true").lower() in ("1", "true", "yes")
+
+
+def classify_request(user_request):
+    """'simple' or 'complex', from request length and wording"""
+    text = user_request.lower()
+    max_simple_words = int(os.environ.get("LLM_ROUTER_MAX_SIMPLE_WORDS", 20))
+
+    if len(text.split()) > max_simple_words:
+        return 'complex'
+    if any(keyword in text for keyword in COMPLEX_KEYWORDS):
+        return 'complex'
+    # Three or more compared series ("A vs B vs C", "A, B and C")
+    if len(re.findall(r'\bvs\.?\b|\bversus\b|\bcompared to\b', text)) >= 2:
+        return 'complex'
+    return 'simple'
+
+
+def get_model_tiers(user_request):
+    """Models to try in order for this request"""
+    strong_model = os.environ.get("LLM_STRONG_MODEL", DEFAULT_STRONG_MODEL)
+    if not routing_enabled() or classify_request(user_request) == 'complex':
+        return [strong_model]
+    return [os.environ.get("LLM_FAST_MODEL", DEFAULT_FAST_MODEL), strong_model]
+
+
+def _record(model, latency, valid):
+    with _stats_lock:
+        stats = _stats.setdefault(model, {'attempts': 0, 'valid': 0, 'invalid': 0, 'errors': 0, 'latency_total': 0.0})
+        stats['attempts'] += 1
+        stats['latency_total'] += latency
+        if valid is None:
+            stats['errors'] += 1
+        elif valid:
+            stats['valid'] += 1
+        else:
+            stats['invalid'] += 1
+
+
+def get_router_stats():
+    """Per-model attempt counts, validation outcomes and mean latency"""
+    with _stats_lock:
+        result = {}
+        for model, stats in _stats.items():
+            result[model] = dict(stats, latency_avg=stats['latency_total'] / stats['attempts'])
+        return result
+
+
+def _check_attempt(model, request_class, latency, python_code, escalation_possible):
+    """Validate one tier's code and record the attempt. Returns None if valid, else the error."""
+    ok, reason = validate_graph_code(python_code)
+    _record(model, latency, ok)
+
+    escalating = not ok and escalation_possible
+    logger.info(f"Model router: {model} for {request_class} request, {latency:.2f}s, "
+                f"validation={reason}{', escalating' if escalating else ''}")
+    return None if ok else Exception(f"Generated code failed validation: {reason}")
+
+
+def _record_failure(model, request_class, latency, error):
+    _record(model, latency, None)
+    logger.warning(f"Model router: {model} failed after {latency:.2f}s ({request_class} request): {str(error)}")
+
+
+def generate_with_routing(user_request, tiers, generate, terminal_errors=()):
+    """
+    Call generate(model) for each tier until the code validates.
+    Raises the last failure if no tier produces valid code. Errors of the
+    terminal_errors types are raised at once instead of escalating.
+    """
+    request_class = classify_request(user_request)
+    last_error = None
+
+    for i, model in enumerate(tiers):
+        start = time.monotonic()
+        try:
+            python_code = generate(model)
+        except terminal_errors as e:
+            # e.g. an exhausted time budget: a stronger, slower model won't fit in it either
+            _record_failure(model, request_class, time.monotonic() - start, e)
+            raise
+        except Exception as e:
+            _record_failure(model, request_class, time.monotonic() - start, e)
+            last_error = e
+            continue
+
+        last_error = _check_attempt(model, request_class, time.monotonic() - start, python_code, i + 1 < len(tiers))
+        if last_error is None:
+            return python_code
+
+    raise last_error
+
+
+async def async_generate_with_routing(user_request, tiers, generate, terminal_errors=()):
+    """generate_with_routing for a coroutine generate(model)"""
+    request_class = classify_request(user_request)
+    last_error = None
+
+    for i, model in enumerate(tiers):
+        start = time.monotonic()
+        try:
+            python_code = await generate(model)
+        except terminal_errors as e:
+            _record_failure(model, request_class, time.monotonic() - start, e)
+            raise
+        except Exception as e:
+            _record_failure(model, request_class, time.monotonic() - start, e)
+            last_error = e
+            continue
+
+        last_error = _check_attempt(model, request_class, time.monotonic() - start, python_code, i + 1 < len(tiers))
+        if last_error is None:
+            return python_code
+
+    raise last_error
@@ -0,0 +1,157 @@
+"""
+Disk cache of rendered graph images
+Keyed by a hash of the graph code plus render settings, bounded by total size with LRU eviction
+"""
+
+import os
+import json
+import uuid
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Settings every render currently uses; part of the cache key
+DEFAULT_RENDER_SETTINGS = {
+    'dpi': 300,
+    'figsize': [12, 8],
+    'backend': 'agg',
+    'format': 'png',
+    # Bumped when the same code renders differently, so older images aren't served
+    'renderer': 2,
+}
+
+
+def render_cache_key(source, settings=None):
+    """Hash of the code (or chart spec) being rendered and the settings it is rendered with"""
+    settings = dict(DEFAULT_RENDER_SETTINGS, **(settings or {}))
+    key_data = json.dumps({'source': source, 'settings': settings}, sort_keys=True)
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """Size-bounded directory of rendered images, evicting least recently used first"""
+
+    def __init__(self, cache_dir, max_bytes=50 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.img")
+
+    def _load_index(self):
+        # Rebuild the LRU order from file access times left by earlier runs
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.img'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, name[:-4], stat.st_size))
+
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def get(self, key):
+        """Return cached image bytes or None"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)
+            except OSError:
+                self._forget(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def set(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            path = self._path(key)
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except OSError as e:
+                logger.error(f"Render cache write failed: {str(e)}")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return
+
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+            }
+
+    def _forget(self, key):
+        self._total_bytes -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._forget(key)
+
+
+_render_cache = None
+_render_cache_lock = threading.Lock()
+
+
+def get_render_cache():
+    """Return the process-wide render cache, or None if disabled (ROI_RENDER_CACHE_MAX_MB=0)"""
+    global _render_cache
+    with _render_cache_lock:
+        if _render_cache is None:
+            max_mb = int(os.environ.get("ROI_RENDER_CACHE_MAX_MB", 50))
+            if max_mb <= 0:
+                return None
+            cache_dir = os.environ.get("ROI_RENDER_CACHE_DIR") or os.path.join(
+                tempfile.gettempdir(), "roi-render-cache"
+            )
+            try:
+                _render_cache = RenderCache(cache_dir, max_bytes=max_mb * 1024 * 1024)
+            except OSError as e:
+                logger.error(f"Render cache disabled: {str(e)}")
+                return None
+        return _render_cache
@@ -0,0 +1,253 @@
+"""
+In-memory capture of images saved by generated graph code
+Generated code keeps calling savefig('output.png'); the image lands in a buffer instead of on disk.
+Each capture owns its figures and Agg canvases, so renders on different threads never share pyplot state.
+"""
+
+import io
+import os
+import builtins
+import functools
+import threading
+import contextlib
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from render_profiles import get_profile, encode_image
+from metrics import time_stage
+from code_validator import GLOBAL_CONFIG_NAMES, UNSAFE_MODULE_NAMES
+
+# The only file name generated code is allowed to save to
+OUTPUT_NAME = 'output.png'
+
+
+class RenderCapture:
+    """
+    Stand-ins for matplotlib and pyplot handed to generated code.
+    savefig('output.png') on pyplot or on any figure it creates is written to
+    image_data, using the render profile's size, DPI and format in place of
+    whatever the code asked for; saving anywhere else raises.
+    """
+
+    def __init__(self, profile=None):
+        self.image_data = None
+        self.profile = get_profile(profile)
+        self.pyplot = _FigurePyplot(self)
+        self.matplotlib = _Proxy(matplotlib, {'pyplot': self.pyplot})
+
+    def save(self, fig, fname, *args, **kwargs):
+        if not isinstance(fname, (str, os.PathLike)) or os.path.basename(os.fspath(fname)) != OUTPUT_NAME:
+            raise Exception(f"Graph code may only save to {OUTPUT_NAME}")
+
+        if tuple(fig.get_size_inches()) != tuple(self.profile.figsize):
+            fig.set_size_inches(self.profile.figsize)
+        kwargs['dpi'] = self.profile.dpi
+        kwargs['format'] = self.profile.savefig_format
+        buffer = io.BytesIO()
+        with time_stage('savefig'):
+            Figure.savefig(fig, buffer, *args, **kwargs)
+        with time_stage('encode'):
+            self.image_data = encode_image(buffer.getvalue(), self.profile)
+
+    @contextlib.contextmanager
+    def drawing(self):
+        """Context manager to exec the code in, so pyplot calls made by libraries (df.plot()) land on this capture"""
+        previous = getattr(_active, 'capture', None)
+        _active.capture = self
+        try:
+            yield
+        finally:
+            _active.capture = previous
+
+    def capture_figure(self, fig):
+        # Route fig.savefig through save() for this figure only
+        fig.savefig = lambda fname, *args, **kwargs: self.save(fig, fname, *args, **kwargs)
+        return fig
+
+    def import_hook(self, real_import=builtins.__import__):
+        """__import__ replacement that hands out the capturing modules"""
+        def hooked_import(name, globals=None, locals=None, fromlist=(), level=0):
+            module = real_import(name, globals, locals, fromlist, level)
+            if level != 0:
+                return module
+            if name == 'matplotlib.pyplot' and fromlist:
+                return self.pyplot
+            if name in ('matplotlib', 'matplotlib.pyplot'):
+                # "import matplotlib.pyplot as plt" binds the top package, then reads .pyplot
+                return self.matplotlib
+            return module
+        return hooked_import
+
+    def builtins(self, base=None, real_import=None):
+        """Builtins dict for exec() with the import hook installed"""
+        base = dict(base if base is not None else vars(builtins))
+        base['__import__'] = self.import_hook(real_import or base.get('__import__', builtins.__import__))
+        return base
+
+
+# Capture being exec'd on each thread (see RenderCapture.drawing)
+_active = threading.local()
+
+
+def _route_to_capture(name):
+    """
+    pyplot.<name> that goes to the thread's active capture. pandas plotting without ax=
+    calls the real pyplot, which would draw on a global figure the capture never saves.
+    """
+    original = getattr(plt, name)
+
+    @functools.wraps(original)
+    def routed(*args, **kwargs):
+        capture = getattr(_active, 'capture', None)
+        if capture is None:
+            return original(*args, **kwargs)
+        return getattr(capture.pyplot, name)(*args, **kwargs)
+    return routed
+
+
+for _name in ('figure', 'gcf', 'gca', 'get_fignums', 'subplots', 'close'):
+    setattr(plt, _name, _route_to_capture(_name))
+
+
+class _Proxy:
+    """Delegates attribute access to a module, except for the overridden names"""
+
+    def __init__(self, module, overrides):
+        self._module = module
+        self._overrides = overrides
+
+    def __getattr__(self, name):
+        if name in self._overrides:
+            return self._overrides[name]
+        if name in GLOBAL_CONFIG_NAMES:
+            raise AttributeError(f"Graph code may not change matplotlib's global '{name}'")
+        if name in UNSAFE_MODULE_NAMES:
+            raise AttributeError(f"Graph code may not use '{name}'")
+        return getattr(self._module, name)
+
+
+class _FigurePyplot:
+    """
+    pyplot for generated code, backed by figures this capture owns.
+    Figure-level calls go to the current figure and plotting calls to its
+    current axes; nothing touches pyplot's global figure manager.
+    """
+
+    # pyplot functions whose Axes method has a set_/get_ prefix
+    _AXES_PROPERTIES = ('title', 'xlabel', 'ylabel', 'xlim', 'ylim', 'xscale', 'yscale')
+    _FIGURE_KWARGS = ('figsize', 'dpi', 'facecolor', 'edgecolor', 'frameon', 'layout')
+
+    def __init__(self, capture):
+        self._capture = capture
+        self._figures = []
+
+    def figure(self, num=None, figsize=None, clear=False, **kwargs):
+        if isinstance(num, Figure):
+            fig = num
+        else:
+            fig = Figure(figsize=figsize or self._capture.profile.figsize, **kwargs)
+            FigureCanvasAgg(fig)
+            self._capture.capture_figure(fig)
+        if fig in self._figures:
+            self._figures.remove(fig)
+        self._figures.append(fig)
+        if clear:
+            fig.clear()
+        return fig
+
+    def gcf(self):
+        return self._figures[-1] if self._figures else self.figure()
+
+    def get_fignums(self):
+        return list(range(1, len(self._figures) + 1))
+
+    def gca(self):
+        return self.gcf().gca()
+
+    def sca(self, ax):
+        self.figure(ax.figure).sca(ax)
+
+    def subplots(self, nrows=1, ncols=1, **kwargs):
+        fig = self.figure(**{name: kwargs.pop(name) for name in self._FIGURE_KWARGS if name in kwargs})
+        axes = fig.subplots(nrows, ncols, **kwargs)
+        return fig, axes
+
+    def subplot(self, *args, **kwargs):
+        return self.gcf().add_subplot(*(args or (111,)), **kwargs)
+
+    def axes(self, arg=None, **kwargs):
+        fig = self.gcf()
+        return fig.add_subplot(**kwargs) if arg is None else fig.add_axes(arg, **kwargs)
+
+    def savefig(self, fname, *args, **kwargs):
+        self._capture.save(self.gcf(), fname, *args, **kwargs)
+
+    def close(self, fig=None):
+        if fig == 'all':
+            self._figures = []
+        elif isinstance(fig, Figure):
+            if fig in self._figures:
+                self._figures.remove(fig)
+        elif self._figures:
+            self._figures.pop()
+
+    def clf(self):
+        self.gcf().clear()
+
+    def show(self, *args, **kwargs):
+        pass
+
+    def xticks(self, ticks=None, labels=None, **kwargs):
+        return self._ticks(self.gca().xaxis, ticks, labels, **kwargs)
+
+    def yticks(self, ticks=None, labels=None, **kwargs):
+        return self._ticks(self.gca().yaxis, ticks, labels, **kwargs)
+
+    def _ticks(self, axis, ticks, labels, minor=False, **kwargs):
+        # Same semantics as pyplot.xticks/yticks, on this capture's axes
+        locs = axis.get_ticklocs(minor=minor) if ticks is None else axis.set_ticks(ticks, minor=minor)
+        if labels is None:
+            labels = axis.get_ticklabels(minor=minor)
+            for label in labels:
+                label.update(kwargs)
+        else:
+            labels = axis.set_ticklabels(labels, minor=minor, **kwargs)
+        return locs, labels
+
+    def suptitle(self, *args, **kwargs):
+        return self.gcf().suptitle(*args, **kwargs)
+
+    def figtext(self, *args, **kwargs):
+        return self.gcf().text(*args, **kwargs)
+
+    def colorbar(self, mappable=None, **kwargs):
+        ax = self.gca()
+        if mappable is None:
+            mappable = ax.collections[-1] if ax.collections else ax.images[-1]
+        kwargs.setdefault('ax', ax)
+        return self.gcf().colorbar(mappable, **kwargs)
+
+    def __getattr__(self, name):
+        if name in self._AXES_PROPERTIES:
+            def axes_property(*args, **kwargs):
+                ax = self.gca()
+                if not args and not kwargs:
+                    return getattr(ax, f'get_{name}')()
+                return getattr(ax, f'set_{name}')(*args, **kwargs)
+            return axes_property
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if hasattr(Axes, name):
+            return lambda *args, **kwargs: getattr(self.gca(), name)(*args, **kwargs)
+        if hasattr(Figure, name):
+            return lambda *args, **kwargs: getattr(self.gcf(), name)(*args, **kwargs)
+        if name in GLOBAL_CONFIG_NAMES:
+            # rcParams, style and friends are shared by every render in this process
+            raise AttributeError(f"Graph code may not change matplotlib's global '{name}'")
+        if name in UNSAFE_MODULE_NAMES:
+            raise AttributeError(f"Graph code may not use '{name}'")
+        # Stateless helpers (cm, colormaps, ...)
+        return getattr(plt, name)
@@ -0,0 +1,110 @@
+"""
+Render profiles: output resolution and format presets for graph images
+The default suits Slack previews; larger variants are rendered on demand
+"""
+
+import io
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class RenderProfile:
+    """How a graph is rasterized and encoded"""
+
+    def __init__(self, name, dpi, figsize=(12, 8), image_format='png', quantize_colors=0):
+        self.name = name
+        self.dpi = dpi
+        self.figsize = figsize
+        self.image_format = image_format
+        self.quantize_colors = quantize_colors
+
+    @property
+    def savefig_format(self):
+        # WebP and quantized PNG are produced from a plain PNG render
+        return 'pdf' if self.image_format == 'pdf' else 'png'
+
+    @property
+    def file_extension(self):
+        return self.image_format
+
+    def settings(self):
+        """Render settings that make up part of the render cache key"""
+        return {
+            'dpi': self.dpi,
+            'figsize': list(self.figsize),
+            'format': self.image_format,
+            'quantize_colors': self.quantize_colors,
+        }
+
+
+PROFILES = {
+    # 1200x800, palette PNG: sharp at Slack's display size and a fraction of the bytes
+    'slack-preview': RenderProfile('slack-preview', dpi=100, quantize_colors=256),
+    'slack-webp': RenderProfile('slack-webp', dpi=100, image_format='webp'),
+    # The original 3600x2400 PNG
+    'high-res': RenderProfile('high-res', dpi=300),
+    # Vector output for documents and slides
+    'print': RenderProfile('print', dpi=300, image_format='pdf'),
+}
+
+DEFAULT_PROFILE = 'slack-preview'
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_profile(name=None):
+    """Look up a profile by name, defaulting to ROI_RENDER_PROFILE"""
+    if isinstance(name, RenderProfile):
+        return name
+    name = name or os.environ.get("ROI_RENDER_PROFILE", DEFAULT_PROFILE)
+    if name not in PROFILES:
+        logger.warning(f"Unknown render profile '{name}', using {DEFAULT_PROFILE}")
+        name = DEFAULT_PROFILE
+    return PROFILES[name]
+
+
+def encode_image(image_data, profile):
+    """Convert a PNG render into the profile's final format"""
+    if profile.image_format == 'pdf':
+        return image_data
+    if profile.image_format == 'png' and not profile.quantize_colors:
+        return image_data
+
+    # Pillow ships with matplotlib
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_data)).convert('RGB')
+    buffer = io.BytesIO()
+    if profile.image_format == 'webp':
+        image.save(buffer, format='WEBP', quality=90, method=4)
+    else:
+        image = image.quantize(colors=profile.quantize_colors, method=Image.Quantize.FASTOCTREE)
+        image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def record_render(profile, seconds, image_bytes):
+    """Track render time and output size per profile"""
+    with _stats_lock:
+        stats = _stats.setdefault(profile.name, {'renders': 0, 'seconds_total': 0.0, 'bytes_total': 0})
+        stats['renders'] += 1
+        stats['seconds_total'] += seconds
+        stats['bytes_total'] += image_bytes
+    logger.info(f"Rendered {profile.name} image: {image_bytes:,} bytes in {seconds:.2f}s")
+
+
+def get_render_stats():
+    """Per-profile render count, mean render time and mean image size"""
+    with _stats_lock:
+        return {
+            name: dict(
+                stats,
+                seconds_avg=stats['seconds_total'] / stats['renders'],
+                bytes_avg=stats['bytes_total'] / stats['renders']
+            )
+            for name, stats in _stats.items()
+        }
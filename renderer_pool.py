@@ -0,0 +1,211 @@
+"""
+Pool of long-lived sandboxed renderer workers
+Each worker runs `safe_executor.py --serve` and keeps matplotlib imported
+between jobs, so a render no longer pays for container and interpreter startup
+"""
+
+import os
+import json
+import uuid
+import queue
+import logging
+import threading
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+
+class RendererWorker:
+    """One worker process speaking the line-delimited JSON protocol of safe_executor.serve"""
+
+    def __init__(self, command, name=None, startup_timeout=60):
+        self.name = name
+        self.command = command
+        self.jobs_done = 0
+        self.rss_kb = 0
+        self._responses = queue.Queue()
+
+        logger.info(f"Starting renderer worker {name}")
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1
+        )
+
+        # Reader threads so a hung worker can be timed out and stderr never fills up
+        threading.Thread(target=self._read_stdout, daemon=True).start()
+        threading.Thread(target=self._read_stderr, daemon=True).start()
+
+        # Wait for the worker to finish its imports; a worker that never gets there is killed
+        try:
+            ready = self._next_response(startup_timeout)
+            if not ready.get('ready'):
+                raise Exception(f"Renderer worker {name} failed to start")
+        except Exception:
+            self.kill()
+            raise
+        self.rss_kb = ready.get('rss_kb', 0)
+
+    def _read_stdout(self):
+        for line in self.process.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                self._responses.put(json.loads(line))
+            except ValueError:
+                logger.warning(f"Renderer worker {self.name} wrote non-JSON output: {line[:200]}")
+        # EOF: the worker exited
+        self._responses.put(None)
+
+    def _read_stderr(self):
+        for line in self.process.stderr:
+            logger.debug(f"[{self.name}] {line.rstrip()}")
+
+    def _next_response(self, timeout):
+        try:
+            response = self._responses.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"Renderer worker {self.name} timed out")
+        if response is None:
+            raise Exception(f"Renderer worker {self.name} exited unexpectedly")
+        return response
+
+    def request(self, payload, timeout=60):
+        """Send one job and wait for its response"""
+        payload = dict(payload, id=payload.get('id') or uuid.uuid4().hex)
+
+        self.process.stdin.write(json.dumps(payload) + "\n")
+        self.process.stdin.flush()
+
+        # Skip any stale response left over from an earlier timed-out job
+        while True:
+            response = self._next_response(timeout)
+            if response.get('id') == payload['id']:
+                break
+
+        self.jobs_done += 1
+        self.rss_kb = response.get('rss_kb', self.rss_kb)
+        return response
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def close(self, timeout=10):
+        """Close stdin so the worker exits its serve loop"""
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=timeout)
+        except Exception:
+            self.kill()
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait(timeout=5)
+        except Exception:
+            pass
+
+
+class RendererPool:
+    """
+    Fixed-size pool of renderer workers. Workers are started lazily and
+    recycled after max_jobs_per_worker jobs or once their RSS passes max_rss_mb.
+    """
+
+    def __init__(self, command_factory, size=None, max_jobs_per_worker=None,
+                 max_rss_mb=None, on_kill=None):
+        if size is None:
+            size = int(os.environ.get("ROI_RENDER_POOL_SIZE", 2))
+        if max_jobs_per_worker is None:
+            max_jobs_per_worker = int(os.environ.get("ROI_RENDER_MAX_JOBS", 50))
+        if max_rss_mb is None:
+            max_rss_mb = int(os.environ.get("ROI_RENDER_MAX_RSS_MB", 400))
+
+        self.command_factory = command_factory
+        self.size = max(1, size)
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_rss_mb = max_rss_mb
+        self.on_kill = on_kill
+        self._idle = queue.LifoQueue()
+        self._slots = threading.Semaphore(self.size)
+        self._lock = threading.Lock()
+        self._workers = set()
+        self._closed = False
+
+    def _start_worker(self):
+        name = f"roi-render-{uuid.uuid4().hex[:12]}"
+        try:
+            worker = RendererWorker(self.command_factory(name), name=name)
+        except Exception:
+            # The worker process is gone, but a container it started may not be
+            if self.on_kill:
+                try:
+                    self.on_kill(name)
+                except Exception as e:
+                    logger.warning(f"Could not clean up renderer worker {name}: {str(e)}")
+            raise
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _checkout(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return self._start_worker()
+            if worker.is_alive():
+                return worker
+            self._discard(worker)
+
+    def _needs_recycle(self, worker):
+        if self.max_jobs_per_worker and worker.jobs_done >= self.max_jobs_per_worker:
+            return True
+        if self.max_rss_mb and worker.rss_kb > self.max_rss_mb * 1024:
+            return True
+        return not worker.is_alive()
+
+    def _discard(self, worker, kill=False):
+        with self._lock:
+            self._workers.discard(worker)
+        if kill:
+            worker.kill()
+            if self.on_kill:
+                self.on_kill(worker.name)
+        else:
+            worker.close()
+
+    def render(self, payload, timeout=60):
+        """Run one job on a free worker, blocking until a worker is available"""
+        if self._closed:
+            raise Exception("Renderer pool is shut down")
+
+        with self._slots:
+            worker = self._checkout()
+            try:
+                response = worker.request(payload, timeout=timeout)
+            except Exception:
+                # A timed-out or crashed worker is never reused
+                self._discard(worker, kill=True)
+                raise
+
+            if self._needs_recycle(worker):
+                logger.info(f"Recycling renderer worker {worker.name} "
+                            f"(jobs={worker.jobs_done}, rss={worker.rss_kb // 1024}MB)")
+                self._discard(worker)
+            else:
+                self._idle.put(worker)
+
+            return response
+
+    def shutdown(self):
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.close()
@@ -1,25 +1,22 @@
 import os
+import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from slack_bolt import App
 from slack_bolt.adapter.flask import SlackRequestHandler
-from flask import Flask, request
-import tempfile
-
-# Try to import graph_generator, but handle failures gracefully
-try:
-    from graph_generator import generate_roi_graph
-    GRAPH_GENERATOR_AVAILABLE = True
-    logger_import = logging.getLogger(__name__)
-    logger_import.info("Graph generator imported successfully")
-except Exception as e:
-    GRAPH_GENERATOR_AVAILABLE = False
-    logger_import = logging.getLogger(__name__)
-    logger_import.error(f"Failed to import graph_generator: {str(e)}")
-    
-    # Create a dummy function to prevent errors
-    def generate_roi_graph(user_request):
-        raise Exception(f"Graph generator not available: {str(e)}")
+from flask import Flask, request, Response
+from job_queue import JobQueue, QueueFullError, RetryJobError, current_job, checkpoint
+from job_store import get_job_backend
+from admission import AdmissionController
+from render_profiles import get_profile
+from slack_messages import (HIGH_RES_PROFILE, EMPTY_REQUEST_TEXT, EMPTY_BATCH_TEXT, QUEUE_FULL_TEXT, HELP_TEXT,
+                            rate_limited_text, generating_text, upload_kwargs, high_res_blocks, error_text,
+                            parse_batch_text, batch_generating_text, batch_upload_kwargs, preview_upload_kwargs,
+                            uploaded_file_id)
+from metrics import time_stage, register_collector, render_prometheus
+from slack_dedup import dedup_middleware
 
 # Load environment variables
 load_dotenv()
@@ -31,6 +28,36 @@ logger = logging.getLogger(__name__)
 # Log startup
 logger.info("🚀 ROI Slack Bot starting up...")
 
+# The generation stack (matplotlib, pandas, numpy, openai) is imported on first use,
+# so /health and Slack's URL verification answer before it has loaded
+_generate_roi_graph = None
+_generator_import_error = None
+_generator_lock = threading.Lock()
+
+def get_graph_generator():
+    """Import graph_generator once and return its generate_roi_graph, or raise if it failed to import"""
+    global _generate_roi_graph, _generator_import_error
+    with _generator_lock:
+        if _generate_roi_graph is None and _generator_import_error is None:
+            start = time.perf_counter()
+            try:
+                from graph_generator import generate_roi_graph
+                _generate_roi_graph = generate_roi_graph
+                logger.info(f"Graph generator imported successfully in {time.perf_counter() - start:.2f}s")
+            except Exception as e:
+                _generator_import_error = e
+                logger.error(f"Failed to import graph_generator: {str(e)}")
+    if _generator_import_error is not None:
+        raise Exception("Graph generator is not available - check logs for import errors")
+    return _generate_roi_graph
+
+def preload_graph_generator():
+    """Load the generation stack in the background so the first /roi doesn't pay for it"""
+    try:
+        get_graph_generator()
+    except Exception:
+        pass
+
 # Initialize Flask first
 flask_app = Flask(__name__)
 
@@ -65,11 +92,271 @@ else:
             slack_app = None
             handler = None
 
+def process_roi_job(payload):
+    """
+    Generate and upload a graph for a queued /roi request (runs on a worker thread)
+    Each finished stage is checkpointed on the job, so a retried or recovered job
+    resumes where it stopped and never posts the same graph twice.
+    """
+    user_text = payload['user_text']
+    channel_id = payload['channel_id']
+    user_id = payload['user_id']
+    profile = get_profile(payload.get('profile'))
+    job = current_job()
+    done = job.checkpoints if job is not None else {}
+    preview_id = done.get('preview')
+    
+    if 'uploaded' in done:
+        logger.info(f"Job {job.id} was already delivered")
+        return
+    
+    try:
+        # Loads the generation stack on first use; raises if it failed to import
+        generate_roi_graph = get_graph_generator()
+        from graph_generator import speculative_preview_enabled, generate_roi_graph_preview, execute_graph_code
+        
+        # Post a cheap preview first (a template render is already the final graph)
+        image_data = done.get('rendered')
+        preview_data = None
+        try_template = True
+        if image_data is None and slack_app is not None and speculative_preview_enabled():
+            with time_stage('preview'):
+                preview_data, is_final = generate_roi_graph_preview(user_text, profile)
+            try_template = False
+            if is_final:
+                image_data = preview_data
+                checkpoint('rendered', image_data)
+            elif preview_id is None:
+                # The preview is only a head start; without it the user still gets the full graph
+                try:
+                    with time_stage('slack_upload'):
+                        result = slack_app.client.files_upload_v2(
+                            channel=channel_id,
+                            **preview_upload_kwargs(user_text, profile, preview_data)
+                        )
+                    preview_id = uploaded_file_id(result)
+                    checkpoint('preview', preview_id)
+                except Exception as e:
+                    logger.warning(f"Could not post preview graph: {str(e)}")
+        
+        # Generate the graph, from the LLM code if an earlier attempt got that far
+        if image_data is None:
+            python_code = done.get('llm_done')
+            logger.info(f"Generating {profile.name} graph for user {user_id}: {user_text}")
+            with admission.render_slot():
+                with time_stage('generate'):
+                    if python_code is not None:
+                        image_data = execute_graph_code(python_code, user_text, profile)
+                    else:
+                        image_data = generate_roi_graph(
+                            user_text, profile, on_code=lambda code: checkpoint('llm_done', code),
+                            try_template=try_template
+                        )
+            
+            # The LLM failed and produced the preview's fallback graph: the preview stands
+            if preview_id and image_data == preview_data:
+                logger.info(f"Keeping the preview as the final graph for user {user_id}")
+                checkpoint('uploaded', preview_id)
+                return
+            checkpoint('rendered', image_data)
+        
+        # Upload image to Slack straight from memory using the modern method
+        if slack_app is not None:
+            deliver_graph(job, channel_id, upload_kwargs(user_text, profile, image_data, upload_id=job and job.id[:12]))
+            if preview_id:
+                delete_preview(preview_id)
+        
+        logger.info(f"Successfully uploaded graph for user {user_id}")
+        
+        # Offer the full-resolution render on demand
+        if slack_app is not None and profile.name != HIGH_RES_PROFILE:
+            offer_high_res(channel_id, user_id, user_text)
+        
+    except Exception as e:
+        logger.error(f"Error generating graph: {str(e)}")
+        
+        # The upload will be retried with the rendered graph; stay quiet until the last attempt
+        retrying = isinstance(e, RetryJobError) and job is not None and not job_queue.is_last_attempt(job)
+        
+        # Once a preview is up it is the answer; only report errors when nothing was posted
+        if retrying or preview_id:
+            raise
+        
+        # Send error message
+        if slack_app is not None:
+            slack_app.client.chat_postMessage(
+                channel=channel_id,
+                text=error_text(e)
+            )
+        raise
+
+def offer_high_res(channel_id, user_id, user_text):
+    """Offer the full-resolution render; the graph is already posted, so a failure here is only logged"""
+    try:
+        slack_app.client.chat_postEphemeral(
+            channel=channel_id,
+            user=user_id,
+            text="Need a sharper copy of this graph?",
+            blocks=high_res_blocks(user_text)
+        )
+    except Exception as e:
+        logger.warning(f"Could not offer a high-res copy to user {user_id}: {str(e)}")
+
+def deliver_graph(job, channel_id, upload):
+    """
+    Upload a graph, or the graphs of a batch, at most once per job. An upload that
+    may have gone through before a crash is looked up by its filename instead of
+    being posted again.
+    """
+    done = job.checkpoints if job is not None else {}
+    # A batch upload is looked up by its first file
+    filename = upload['filename'] if 'filename' in upload else upload['file_uploads'][0]['filename']
+    file_id = None
+    if 'uploading' in done:
+        file_id = find_uploaded_file(channel_id, filename, done['uploading'])
+    if file_id is None:
+        checkpoint('uploading', time.time())
+        try:
+            with time_stage('slack_upload'):
+                result = slack_app.client.files_upload_v2(channel=channel_id, **upload)
+        except Exception as e:
+            raise RetryJobError(f"Upload failed: {str(e)}")
+        file_id = uploaded_file_id(result)
+    checkpoint('uploaded', file_id)
+    return file_id
+
+def find_uploaded_file(channel_id, filename, since):
+    """ID of a file the bot already posted to the channel under this name, or None"""
+    try:
+        response = slack_app.client.files_list(channel=channel_id, ts_from=int(since) - 60, count=100)
+    except Exception as e:
+        logger.warning(f"Could not check for an earlier upload of {filename}: {str(e)}")
+        return None
+    for uploaded in response.get('files', []):
+        if uploaded.get('name') == filename:
+            logger.info(f"Found earlier upload of {filename}, not posting it again")
+            return uploaded.get('id')
+    return None
+
+def delete_preview(file_id):
+    """Remove a preview once the full graph is posted"""
+    try:
+        slack_app.client.files_delete(file=file_id)
+    except Exception as e:
+        logger.warning(f"Could not delete preview {file_id}: {str(e)}")
+
+def process_roi_batch_job(payload):
+    """Generate every graph of a /roi-batch request concurrently and upload them together"""
+    items = payload['items']
+    channel_id = payload['channel_id']
+    user_id = payload['user_id']
+    profile = get_profile(payload.get('profile'))
+    
+    # A recovered batch that was already posted isn't posted again
+    job = current_job()
+    if job is not None and 'uploaded' in job.checkpoints:
+        logger.info(f"Job {job.id} was already delivered")
+        return
+    
+    try:
+        generate_roi_graph = get_graph_generator()
+        
+        # LLM calls and renders overlap, so the batch takes about as long as its slowest graph
+        logger.info(f"Generating batch of {len(items)} {profile.name} graphs for user {user_id}")
+        concurrency = max(1, min(len(items), int(os.environ.get("ROI_BATCH_CONCURRENCY", 4))))
+        
+        def generate(item):
+            # A slot per graph, so a batch counts against ROI_MAX_CONCURRENT_RENDERS like single requests
+            with admission.render_slot():
+                return generate_roi_graph(item, profile)
+        
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="roi-batch") as pool:
+            futures = [pool.submit(generate, item) for item in items]
+            results = []
+            for item, future in zip(items, futures):
+                try:
+                    results.append((item, future.result()))
+                except Exception as e:
+                    logger.error(f"Error generating batch graph '{item}': {str(e)}")
+                    results.append((item, e))
+        
+        upload = batch_upload_kwargs(results, profile, upload_id=job and job.id[:12])
+        if not upload['file_uploads']:
+            raise results[0][1]
+        
+        # One multi-file upload instead of a message per graph
+        if slack_app is not None:
+            deliver_graph(job, channel_id, upload)
+        
+        logger.info(f"Successfully uploaded {len(upload['file_uploads'])} graphs for user {user_id}")
+        
+    except Exception as e:
+        logger.error(f"Error generating graph batch: {str(e)}")
+        
+        # The upload will be retried; stay quiet until the last attempt
+        if isinstance(e, RetryJobError) and job is not None and not job_queue.is_last_attempt(job):
+            raise
+        
+        if slack_app is not None:
+            slack_app.client.chat_postMessage(
+                channel=channel_id,
+                text=error_text(e)
+            )
+        raise
+
+# Background workers do the LLM call, render and upload so Slack handlers return immediately
+# With ROI_JOB_DB set, jobs survive restarts and resume from their last finished stage
+job_queue = JobQueue(backend=get_job_backend())
+job_queue.register("roi", process_roi_job)
+job_queue.register("roi_batch", process_roi_batch_job)
+
+# Rate limits per user, team and globally, and a cap on concurrent renders
+admission = AdmissionController()
+
+def collect_web_metrics():
+    """Scrape-time metric families for the job queue and admission control"""
+    admission_stats = admission.stats()
+    return [
+        ("roi_job_queue_depth", "gauge", "Jobs waiting for a worker", [({}, job_queue.depth())]),
+        ("roi_active_renders", "gauge", "Renders holding a render slot",
+         [({}, admission_stats['active_renders'])]),
+        ("roi_admitted_total", "counter", "Requests admitted by rate limiting",
+         [({}, admission_stats['admitted'])]),
+        ("roi_rejected_total", "counter", "Requests shed by rate limiting",
+         [({'scope': scope}, count) for scope, count in admission_stats['rejected'].items()]),
+    ]
+
+register_collector(collect_web_metrics)
+
+def enqueue_roi_job(payload, kind="roi"):
+    """
+    Apply admission control and queue a generation job.
+    Returns (job, None) when queued, or (None, message) when the request is shed.
+    """
+    # A batch counts against the rate limits once per graph
+    cost = len(payload.get('items', ())) or 1
+    decision = admission.check(payload['user_id'], payload.get('team_id'), cost=cost)
+    if not decision.admitted:
+        return None, rate_limited_text(decision)
+    
+    try:
+        return job_queue.submit(kind, payload), None
+    except QueueFullError:
+        logger.warning(f"Job queue full, rejecting request from user {payload['user_id']}")
+        return None, QUEUE_FULL_TEXT
+
 if slack_app is not None:
+    # Slack retries slow requests; a repeat delivery is acknowledged without queuing another job
+    slack_app.use(dedup_middleware)
+    job_queue.start()
+    if os.environ.get("ROI_PRELOAD_GENERATOR", "true").lower() in ("1", "true", "yes"):
+        threading.Thread(target=preload_graph_generator, name="roi-preload", daemon=True).start()
+
     @slack_app.command("/roi")
     def handle_roi_command(ack, respond, command):
         """Handle /roi slash command"""
-        ack()
+        with time_stage('slack_ack'):
+            ack()
         
         user_text = command['text']
         channel_id = command['channel_id']
@@ -77,77 +364,90 @@ if slack_app is not None:
         
         if not user_text.strip():
             respond({
-                "text": "Please provide a description for your ROI graph!\nExample: `/roi VR training vs traditional training over 3 years`",
+                "text": EMPTY_REQUEST_TEXT,
                 "response_type": "ephemeral"
             })
             return
         
-        # Send immediate response
+        job, rejection = enqueue_roi_job({
+            "user_text": user_text,
+            "channel_id": channel_id,
+            "user_id": user_id,
+            "team_id": command.get('team_id')
+        })
+        if rejection:
+            respond({"text": rejection, "response_type": "ephemeral"})
+            return
+        
+        # Let the user know the job is queued, and where, if renders are backed up
+        if admission.renders_saturated():
+            text = f"⏳ Busy right now: your graph for *{user_text}* is queued at position {job_queue.depth()}."
+        else:
+            text = generating_text(user_text)
+        respond({"text": text, "response_type": "ephemeral"})
+        logger.info(f"Queued job {job.id} for user {user_id}")
+
+    @slack_app.action("roi_high_res")
+    def handle_high_res_action(ack, body, respond):
+        """Re-render a graph with the high-res profile when its button is clicked"""
+        ack()
+        
+        user_text = body['actions'][0]['value']
+        user_id = body['user']['id']
+        channel_id = body['channel']['id']
+        
+        job, rejection = enqueue_roi_job({
+            "user_text": user_text,
+            "channel_id": channel_id,
+            "user_id": user_id,
+            "team_id": body.get('team', {}).get('id'),
+            "profile": HIGH_RES_PROFILE
+        })
+        if rejection:
+            respond({
+                "text": rejection,
+                "response_type": "ephemeral",
+                "replace_original": False
+            })
+            return
+        
         respond({
-            "text": f"🎯 Generating ROI graph for: *{user_text}*\nThis may take 15-30 seconds...",
-            "response_type": "ephemeral"
+            "text": f"🔍 Rendering a high-res version of: *{user_text}*",
+            "response_type": "ephemeral",
+            "replace_original": True
         })
+
+    @slack_app.command("/roi-batch")
+    def handle_roi_batch_command(ack, respond, command):
+        """Handle /roi-batch: several graph requests separated by ';' or new lines"""
+        with time_stage('slack_ack'):
+            ack()
         
-        try:
-            # Check if graph generator is available
-            if not GRAPH_GENERATOR_AVAILABLE:
-                raise Exception("Graph generator is not available - check logs for import errors")
-            
-            # Generate the graph
-            logger.info(f"Generating graph for user {user_id}: {user_text}")
-            image_path = generate_roi_graph(user_text)
-            
-            # Upload image to Slack using the modern method
-            if slack_app is not None:
-                result = slack_app.client.files_upload_v2(
-                    channel=channel_id,
-                    file=image_path,
-                    title=f"ROI Analysis: {user_text[:50]}{'...' if len(user_text) > 50 else ''}",
-                    initial_comment=f"📊 Here's your ROI analysis for: *{user_text}*"
-                )
-            
-            # Clean up temp file
-            if os.path.exists(image_path):
-                os.remove(image_path)
-            
-            logger.info(f"Successfully uploaded graph for user {user_id}")
-            
-        except Exception as e:
-            logger.error(f"Error generating graph: {str(e)}")
-            
-            # Send error message
-            if slack_app is not None:
-                slack_app.client.chat_postMessage(
-                    channel=channel_id,
-                    text=f"❌ Sorry, I couldn't generate that graph. Error: {str(e)[:200]}...\n\nTry rephrasing your request or contact support."
-                )
+        items, skipped = parse_batch_text(command['text'], int(os.environ.get("ROI_BATCH_MAX_ITEMS", 6)))
+        if not items:
+            respond({"text": EMPTY_BATCH_TEXT, "response_type": "ephemeral"})
+            return
+        
+        job, rejection = enqueue_roi_job({
+            "items": items,
+            "channel_id": command['channel_id'],
+            "user_id": command['user_id'],
+            "team_id": command.get('team_id')
+        }, kind="roi_batch")
+        if rejection:
+            respond({"text": rejection, "response_type": "ephemeral"})
+            return
+        
+        respond({"text": batch_generating_text(items, skipped), "response_type": "ephemeral"})
+        logger.info(f"Queued batch job {job.id} ({len(items)} graphs) for user {command['user_id']}")
 
     @slack_app.command("/roi-help")
     def handle_help_command(ack, respond):
         """Provide help for the ROI bot"""
         ack()
         
-        help_text = """
-📊 *ROI Graph Generator Help*
-
-*Usage:* `/roi [your request]`
-
-*Example requests:*
-• `/roi VR training vs traditional training ROI over 3 years`
-• `/roi Cost savings from VR implementation quarterly breakdown`
-• `/roi Training efficiency improvements monthly comparison`
-• `/roi Employee satisfaction before and after VR training`
-
-*Tips:*
-• Be specific about time periods (monthly, quarterly, yearly)
-• Mention what you're comparing (VR vs traditional, before vs after)
-• Include context about your industry if relevant
-
-*Need help?* Contact your admin or try simpler requests first.
-        """
-        
         respond({
-            "text": help_text,
+            "text": HELP_TEXT,
             "response_type": "ephemeral"
         })
 
@@ -156,6 +456,19 @@ if slack_app is not None:
 def health_check():
     return "ROI Bot is running! 🎯", 200
 
+# Prometheus scrape endpoint
+@flask_app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Background job status
+@flask_app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    status = job_queue.get_status(job_id)
+    if status is None:
+        return {"error": "Unknown job"}, 404
+    return status, 200
+
 # Slack events endpoint
 @flask_app.route("/slack/events", methods=["POST", "GET"])
 def slack_events():
@@ -209,7 +522,7 @@ def home():
 if __name__ == "__main__":
     # For local development
     logger.info("🚀 Starting ROI Slack Bot...")
-    logger.info(f"Graph generator available: {GRAPH_GENERATOR_AVAILABLE}")
+    logger.info(f"Graph generator loaded: {_generate_roi_graph is not None}")
     port = int(os.environ.get("PORT", 3000))
     logger.info(f"Starting Flask app on port {port}")
     flask_app.run(debug=True, host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,305 @@
+"""
+Template library for common ROI request shapes
+A local parser pulls the period granularity, horizon and compared series out of a
+request; requests that fit a known shape become a chart spec without calling the LLM.
+Anything the parser isn't sure about returns None and goes to the LLM as before.
+"""
+
+import os
+import re
+import math
+import logging
+import threading
+from chart_spec import validate_chart_spec, MAX_PERIODS, MAX_SERIES
+
+logger = logging.getLogger(__name__)
+
+NUMBER_WORDS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6,
+    'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12,
+}
+
+# Granularity -> (phrases, periods per year, default number of periods)
+GRANULARITIES = {
+    'weekly': (r'weekly|per week|week by week|week over week', 52, 12),
+    'monthly': (r'monthly|per month|by month|month by month|month over month', 12, 12),
+    'quarterly': (r'quarterly|per quarter|by quarter|quarter by quarter|quarter over quarter', 4, 8),
+    'yearly': (r'yearly|annual|annually|per year|by year|year by year|year over year', 1, 5),
+}
+
+HORIZON_UNITS = {'week': 1 / 52, 'month': 1 / 12, 'quarter': 1 / 4, 'year': 1}
+
+# Metric keywords -> (kind, unit, y axis label); the first match wins, ROI is the default
+METRICS = [
+    (r'cost savings|savings|saved', 'savings', '$', 'Cumulative Cost Savings ($)'),
+    (r'revenue', 'savings', '$', 'Cumulative Revenue ($)'),
+    (r'satisfaction|engagement|retention', 'score', '%', 'Satisfaction (%)'),
+    (r'efficiency|productivity|performance|completion', 'growth', '%', 'Improvement (%)'),
+    (r'\broi\b|return on investment|return', 'roi', '%', 'ROI (%)'),
+]
+
+# Requests asking for anything the line templates can't draw go to the LLM
+UNSUPPORTED = re.compile(
+    r'\b(bar|pie|scatter|histogram|heat ?map|table|stacked|area|donut|funnel|waterfall|breakdown by|'
+    r'by department|by region|by team|per employee|forecast|projection|budget|investment of)\b'
+)
+
+# Words the rising line templates can't honor: falling or negative values, questions and styling
+UNHONORED = frozenset((
+    'decline', 'declining', 'decrease', 'decreasing', 'drop', 'dropping', 'fall', 'falling', 'down',
+    'negative', 'loss', 'losses', 'losing', 'fail', 'failed', 'failing', 'failure', 'worse', 'worst',
+    'why', 'how', 'what', 'when', 'which', 'who', 'does', 'do', 'did', 'is', 'are', 'should', 'can',
+    'explain', 'log', 'logarithmic', 'scale', 'axis', 'color', 'colour', 'colors', 'dashed', 'dotted',
+    'legend', 'annotate', 'annotated', 'highlight', 'label', 'labels', 'style', 'theme', 'dark',
+    'with', 'without', 'excluding', 'including', 'except',
+))
+
+MAX_LABEL_WORDS = 5
+MAX_LABEL_LENGTH = 40
+
+ACRONYMS = ('vr', 'ar', 'xr', 'ai', 'lms', 'hr', 'it')
+
+COMPARISON = re.compile(r'\s+(?:vs\.?|versus|compared (?:to|with)|against)\s+')
+BEFORE_AFTER = re.compile(r'\bbefore and after\s+(.+)$')
+
+# Words that describe the chart rather than name a series
+FILLER = re.compile(
+    r'\b(show me|show|create|make|plot|graph|chart|line|a|the|an|of|from|for|please|comparison|compare|'
+    r'breakdown|improvements?|analysis|trend|over time|over|per|by|in|roi|return on investment)\b'
+)
+
+_stats = {'hits': 0, 'misses': 0, 'shapes': {}}
+_stats_lock = threading.Lock()
+
+
+def templates_enabled():
+    return os.environ.get("ROI_TEMPLATES", "true").lower() in ("1", "true", "yes")
+
+
+def _number(word):
+    return int(word) if word.isdigit() else NUMBER_WORDS.get(word)
+
+
+def parse_request(user_request):
+    """
+    Extract the parameters of a templated request, or None if the request doesn't fit a template.
+    Returns {'shape', 'granularity', 'periods', 'metric', 'series'}.
+    """
+    text = re.sub(r'\s+', ' ', user_request.lower()).strip().rstrip('.!?')
+    if not text or UNSUPPORTED.search(text):
+        return None
+
+    granularity = None
+    for name, (phrases, _, _) in GRANULARITIES.items():
+        match = re.search(rf'\b({phrases})\b', text)
+        if match:
+            granularity = name
+            text = text.replace(match.group(0), ' ')
+            break
+
+    horizon_years = None
+    match = re.search(r'\b(?:over |for |across |in )?(?:the )?(?:next |first )?(\d+|' + '|'.join(NUMBER_WORDS)
+                      + r')[ -](week|month|quarter|year)s?\b', text)
+    if match:
+        count = _number(match.group(1))
+        if not count:
+            return None
+        horizon_years = count * HORIZON_UNITS[match.group(2)]
+        if granularity is None:
+            # Short horizons read best with finer periods
+            unit = match.group(2)
+            granularity = {'week': 'weekly', 'month': 'monthly', 'quarter': 'quarterly'}.get(unit)
+            if granularity is None:
+                granularity = 'quarterly' if count <= 2 else 'yearly'
+        text = text.replace(match.group(0), ' ')
+
+    # Any other number (amounts, percentages, headcounts) is data the template would ignore
+    if re.search(r'\d|\$|%', text):
+        return None
+
+    metric = None
+    for pattern, kind, unit, y_label in METRICS:
+        if re.search(pattern, text):
+            metric = {'kind': kind, 'unit': unit, 'y_label': y_label}
+            break
+
+    before_after = BEFORE_AFTER.search(text)
+    if before_after:
+        if _label(text[:before_after.start()]) is None:
+            return None
+        subject = _label(before_after.group(1))
+        if not subject:
+            return None
+        shape = 'before_after'
+        series = [f"Before {subject}", f"After {subject}"]
+    elif COMPARISON.search(text):
+        shape = 'comparison'
+        series = [_label(part) for part in COMPARISON.split(text)]
+        if not 2 <= len(series) <= MAX_SERIES or not all(series):
+            return None
+        series = _share_suffix(series)
+    else:
+        # A single metric needs a time frame, and a list of things is really a comparison
+        if metric is None or granularity is None or re.search(r',| and ', text):
+            return None
+        label = _label(text)
+        if label is None:
+            return None
+        shape = 'single'
+        series = [label or 'ROI']
+
+    # Comparisons without a time frame read well quarterly
+    granularity = granularity or 'quarterly'
+    per_year, default_periods = GRANULARITIES[granularity][1:]
+    if horizon_years is None:
+        periods = default_periods
+    else:
+        periods = round(horizon_years * per_year)
+    if not 2 <= periods <= MAX_PERIODS:
+        return None
+
+    return {
+        'shape': shape,
+        'granularity': granularity,
+        'periods': periods,
+        'metric': metric or {'kind': 'roi', 'unit': '%', 'y_label': 'ROI (%)'},
+        'series': series,
+    }
+
+
+def _label(text):
+    """
+    Series label from a request fragment: chart filler removed, title-cased.
+    None if the fragment asks for something the template can't draw or is too long to be a name.
+    """
+    words = FILLER.sub(' ', re.sub(r'[^\w\s-]', ' ', text)).split()
+    if len(words) > MAX_LABEL_WORDS or any(word in UNHONORED for word in words):
+        return None
+    label = ''
+    for word in words:
+        word = word.upper() if word in ACRONYMS else word.capitalize()
+        if len(label) + len(word) + 1 > MAX_LABEL_LENGTH:
+            break
+        label = f"{label} {word}" if label else word
+    return label
+
+
+def _share_suffix(labels):
+    """'VR vs traditional training' -> 'VR Training' and 'Traditional Training'"""
+    last = labels[-1].split()
+    if len(last) >= 2 and all(len(label.split()) == 1 for label in labels[:-1]):
+        suffix = last[-1]
+        return [f"{label} {suffix}" for label in labels[:-1]] + [labels[-1]]
+    return labels
+
+
+def period_labels(granularity, count):
+    if granularity == 'weekly':
+        return [f'Week {i}' for i in range(1, count + 1)]
+    if granularity == 'monthly':
+        if count <= 12:
+            return ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'][:count]
+        return [f'Month {i}' for i in range(1, count + 1)]
+    if granularity == 'quarterly':
+        if count <= 4:
+            return [f'Q{i}' for i in range(1, count + 1)]
+        return [f'Y{i // 4 + 1} Q{i % 4 + 1}' for i in range(count)]
+    return [f'Year {i}' for i in range(1, count + 1)]
+
+
+def _curve(start, end, count, rate=3.0):
+    """Values easing from start to end: fast early gains that level off"""
+    if count == 1:
+        return [end]
+    scale = 1 - math.exp(-rate)
+    return [start + (end - start) * (1 - math.exp(-rate * i / (count - 1))) / scale for i in range(count)]
+
+
+def series_values(metric_kind, shape, index, granularity, count, years):
+    """Plausible, deterministic values for series `index` (the first series is the one being pitched)"""
+    if shape == 'before_after':
+        # Before stays roughly flat, after climbs from the same starting point
+        index = 1 - index
+    rank = min(index, 3)
+
+    if metric_kind == 'roi':
+        # An upfront cost puts the pitched option behind before it pulls ahead
+        start = [-25, -5, -10, -15][rank]
+        end = [160, 70, 55, 40][rank] * min(1.5, 0.6 + 0.2 * years)
+        return [round(v, 1) for v in _curve(start, end, count)]
+    if metric_kind == 'savings':
+        per_year = [240000, 90000, 60000, 40000][rank]
+        per_period = per_year / GRANULARITIES[granularity][1]
+        ramp = _curve(0.4, 1.0, count)
+        total = 0
+        values = []
+        for factor in ramp:
+            total += per_period * factor
+            values.append(round(total, -2))
+        return values
+    if metric_kind == 'score':
+        start, end = [(64, 88), (62, 68), (60, 66), (58, 64)][rank]
+        return [round(v, 1) for v in _curve(start, end, count)]
+    end = [45, 15, 12, 10][rank]
+    return [round(v, 1) for v in _curve(0, end, count)]
+
+
+def build_spec(params, user_request):
+    """Chart spec for parsed template parameters"""
+    granularity = params['granularity']
+    count = params['periods']
+    years = count / GRANULARITIES[granularity][1]
+    metric = params['metric']
+
+    series = [
+        {'label': label, 'values': series_values(metric['kind'], params['shape'], i, granularity, count, years)}
+        for i, label in enumerate(params['series'])
+    ]
+    if params['shape'] == 'before_after':
+        # Before is the baseline: draw it grey
+        series[0]['color'] = '#7D8491'
+
+    title = user_request.strip().rstrip('.!?')
+    return validate_chart_spec({
+        'title': title[:1].upper() + title[1:],
+        'x_label': {'weekly': 'Week', 'monthly': 'Month', 'quarterly': 'Quarter', 'yearly': 'Year'}[granularity],
+        'y_label': metric['y_label'],
+        'unit': metric['unit'],
+        'periods': period_labels(granularity, count),
+        'series': series,
+        'show_values': len(series) == 1 and count <= 12,
+    })
+
+
+def match_template(user_request):
+    """Chart spec for a request that fits a template, or None (the LLM handles it)"""
+    try:
+        params = parse_request(user_request)
+        spec = build_spec(params, user_request) if params else None
+    except Exception as e:
+        logger.error(f"Template matching failed: {str(e)}")
+        params, spec = None, None
+
+    with _stats_lock:
+        if spec is None:
+            _stats['misses'] += 1
+        else:
+            _stats['hits'] += 1
+            _stats['shapes'][params['shape']] = _stats['shapes'].get(params['shape'], 0) + 1
+
+    if spec is not None:
+        logger.info(f"Request matched the '{params['shape']}' template "
+                    f"({params['granularity']}, {params['periods']} periods, {len(params['series'])} series)")
+    return spec
+
+
+def get_template_stats():
+    """Template hits, misses, hit rate and hits per shape"""
+    with _stats_lock:
+        lookups = _stats['hits'] + _stats['misses']
+        return {
+            'hits': _stats['hits'],
+            'misses': _stats['misses'],
+            'hit_rate': _stats['hits'] / lookups if lookups else 0.0,
+            'shapes': dict(_stats['shapes']),
+        }
@@ -7,61 +7,71 @@ Runs in a Docker container with restricted permissions
 import os
 import sys
 import json
-import tempfile
+import base64
+import signal
 import logging
+import resource
+import contextlib
 from graph_generator import get_graph_code_from_llm
+from render_cache import get_render_cache, render_cache_key
+from render_context import RenderCapture
+from render_profiles import get_profile
+from code_validator import ALLOWED_MODULES, compile_graph_code, exec_builtins, CodeValidationError
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def safe_execute_graph_code(python_code, output_path):
+# Modules generated code may import inside the sandbox
+ALLOWED_IMPORTS = ALLOWED_MODULES
+
+def _safe_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """__import__ replacement that only allows the plotting stack"""
+    if level != 0 or name.split('.')[0] not in ALLOWED_IMPORTS:
+        raise ImportError(f"Import of '{name}' is not allowed")
+    return __import__(name, globals, locals, fromlist, level)
+
+def safe_execute_graph_code(python_code, profile=None):
     """
     Safely execute Python code with restricted environment
+    Returns the image as bytes, or None if the code failed
     """
+    profile = get_profile(profile)
+    
+    # Identical code renders to identical bytes, so skip exec on a cache hit
+    render_cache = get_render_cache()
+    cache_key = render_cache_key(python_code, profile.settings())
+    if render_cache is not None:
+        cached_image = render_cache.get(cache_key)
+        if cached_image is not None:
+            logger.info("Using cached render")
+            return cached_image
+    
+    # Reject code that fails the allow-lists without starting a render
     try:
+        code_object = compile_graph_code(python_code)
+    except CodeValidationError as e:
+        logger.error(f"Graph code rejected: {str(e)}")
+        return None
+    
+    try:
+        # savefig('output.png') in the generated code is captured in memory
+        capture = RenderCapture(profile)
+        
         # Create a very restricted execution environment
         safe_globals = {
-            '__builtins__': {
-                'print': print,
-                'len': len,
-                'range': range,
-                'enumerate': enumerate,
-                'zip': zip,
-                'min': min,
-                'max': max,
-                'sum': sum,
-                'abs': abs,
-                'round': round,
-                'int': int,
-                'float': float,
-                'str': str,
-                'list': list,
-                'dict': dict,
-                'tuple': tuple,
-                'set': set,
-                'bool': bool,
-                'type': type,
-                'isinstance': isinstance,
-                'hasattr': hasattr,
-                'getattr': getattr,
-                'setattr': setattr,
-                'Exception': Exception,
-                'ValueError': ValueError,
-                'TypeError': TypeError,
-            }
+            '__builtins__': capture.builtins(exec_builtins(), real_import=_safe_import)
         }
         
         # Import only safe modules
         import matplotlib
         matplotlib.use('Agg')  # Non-interactive backend
-        import matplotlib.pyplot as plt
         import pandas as pd
         import numpy as np
         
         safe_globals.update({
-            'matplotlib': matplotlib,
-            'plt': plt,
+            'matplotlib': capture.matplotlib,
+            'plt': capture.pyplot,
             'pandas': pd,
             'pd': pd,
             'numpy': np,
@@ -69,55 +79,157 @@ def safe_execute_graph_code(python_code, output_path):
         })
         
         # Execute the code
-        exec(python_code, safe_globals)
+        with capture.drawing():
+            exec(code_object, safe_globals)
         
-        # Verify output file was created
-        if not os.path.exists('output.png'):
-            raise Exception("Code did not create output.png file")
+        # Verify output.png was saved
+        if capture.image_data is None:
+            raise Exception("Code did not save output.png")
         
-        # Move the file to the specified output path
-        os.rename('output.png', output_path)
+        if render_cache is not None:
+            render_cache.set(cache_key, capture.image_data)
         
-        return True
+        return capture.image_data
         
     except Exception as e:
         logger.error(f"Error executing graph code: {str(e)}")
-        return False
+        return None
+
+def current_rss_kb():
+    """Resident set size of this process in KB"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def current_address_space_bytes():
+    """Virtual memory size of this process in bytes, or None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+class RenderLimitExceeded(Exception):
+    """Raised inside a render that ran past its CPU time limit"""
+
+def _cpu_limit_exceeded(signum, frame):
+    raise RenderLimitExceeded("Render exceeded its CPU time limit")
+
+def warm_up():
+    """Pay for the heavy imports and font cache once, before the first job"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    import matplotlib.font_manager
+    import pandas
+    import numpy
+    matplotlib.font_manager.findfont('DejaVu Sans')
+
+def init_process_worker():
+    """ProcessPoolExecutor initializer for render workers"""
+    warm_up()
+    # Turn the soft CPU limit into an exception instead of killing the worker
+    signal.signal(signal.SIGXCPU, _cpu_limit_exceeded)
+
+def _set_soft_limit(limit, soft):
+    current_soft, hard = resource.getrlimit(limit)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(limit, (soft, hard))
+    return current_soft
+
+def render_with_limits(python_code, profile=None, cpu_seconds=None, memory_mb=None):
+    """
+    Run safe_execute_graph_code in a pool worker with per-job rlimits.
+    The CPU limit counts from the worker's current CPU time and the memory
+    limit from its current address space, so both apply to this job only.
+    Returns the image as bytes, or None if the code failed or hit a limit.
+    """
+    previous = []
+    try:
+        if cpu_seconds:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            used = int(usage.ru_utime + usage.ru_stime) + 1
+            previous.append((resource.RLIMIT_CPU, _set_soft_limit(resource.RLIMIT_CPU, used + int(cpu_seconds))))
+        address_space = current_address_space_bytes()
+        if memory_mb and address_space is not None:
+            limit = address_space + int(memory_mb) * 1024 * 1024
+            previous.append((resource.RLIMIT_AS, _set_soft_limit(resource.RLIMIT_AS, limit)))
+        
+        return safe_execute_graph_code(python_code, profile)
+    finally:
+        for limit, soft in reversed(previous):
+            resource.setrlimit(limit, (soft, resource.getrlimit(limit)[1]))
+
+def handle_render_request(input_data):
+    """Generate one graph for a pool request and build the response dict"""
+    user_request = input_data.get('user_request')
+    
+    if not user_request:
+        raise ValueError("No user_request provided")
+    
+    logger.info(f"Processing request: {user_request}")
+    python_code = get_graph_code_from_llm(user_request)
+    logger.info("Generated Python code from LLM")
+    
+    # The image travels back over the pipe, so nothing is written to a shared mount
+    image_data = safe_execute_graph_code(python_code, input_data.get('profile'))
+    if image_data is not None:
+        return {
+            'success': True,
+            'image_b64': base64.b64encode(image_data).decode('ascii'),
+            'message': 'Graph generated successfully'
+        }
+    return {
+        'success': False,
+        'error': 'Failed to generate graph'
+    }
+
+def serve():
+    """
+    Long-lived worker loop used by the renderer pool.
+    Reads one JSON request per line on stdin and writes one JSON response
+    per line on stdout until stdin is closed.
+    """
+    warm_up()
+    import matplotlib.pyplot as plt
+    
+    # Keep the real stdout for the protocol; anything the generated code prints goes to stderr
+    protocol_out = sys.stdout
+    print(json.dumps({'ready': True, 'rss_kb': current_rss_kb()}), file=protocol_out, flush=True)
+    
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        
+        request_id = None
+        try:
+            input_data = json.loads(line)
+            request_id = input_data.get('id')
+            with contextlib.redirect_stdout(sys.stderr):
+                response = handle_render_request(input_data)
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            response = {'success': False, 'error': str(e)}
+        finally:
+            plt.close('all')
+        
+        response['id'] = request_id
+        response['rss_kb'] = current_rss_kb()
+        print(json.dumps(response), file=protocol_out, flush=True)
 
 def main():
     """Main execution function for containerized environment"""
     try:
         # Read input from stdin
         input_data = json.loads(sys.stdin.read())
-        user_request = input_data.get('user_request')
-        
-        if not user_request:
-            raise ValueError("No user_request provided")
-        
-        logger.info(f"Processing request: {user_request}")
-        
-        # Get Python code from LLM
-        python_code = get_graph_code_from_llm(user_request)
-        logger.info("Generated Python code from LLM")
-        
-        # Create output file path
-        output_path = '/tmp/graph_output.png'
-        
-        # Execute the code safely
-        success = safe_execute_graph_code(python_code, output_path)
         
-        if success:
-            # Return success response
-            response = {
-                'success': True,
-                'output_path': output_path,
-                'message': 'Graph generated successfully'
-            }
-        else:
-            response = {
-                'success': False,
-                'error': 'Failed to generate graph'
-            }
+        # Generate the graph and return it inline
+        response = handle_render_request(input_data)
         
         print(json.dumps(response))
         
@@ -131,4 +243,7 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
+    if '--serve' in sys.argv:
+        serve()
+    else:
+        main()
@@ -0,0 +1,289 @@
+"""
+Similarity cache for near-duplicate graph requests
+Requests become hashed word and character n-gram vectors, weighted by IDF at lookup
+time; the closest stored request above a cosine threshold serves its graph code.
+Vectors live in a fixed-size float32 matrix, optionally memory-mapped to disk.
+A cache file belongs to one process; give each worker its own path.
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import fcntl
+import logging
+import threading
+import numpy as np
+from code_cache import normalize_request
+
+logger = logging.getLogger(__name__)
+
+STOP_WORDS = frozenset((
+    'a', 'an', 'the', 'of', 'for', 'to', 'and', 'in', 'on', 'over', 'with', 'by', 'from',
+    'show', 'me', 'graph', 'chart', 'plot', 'create', 'make', 'please',
+))
+
+# Spelled-out numbers and abbreviations users mix freely
+SYNONYMS = {
+    'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5', 'six': '6',
+    'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10', 'twelve': '12',
+    'yr': 'year', 'yrs': 'year', 'years': 'year', 'mo': 'month', 'mos': 'month', 'months': 'month',
+    'qtr': 'quarter', 'quarters': 'quarter', 'annual': 'yearly', 'annually': 'yearly',
+    'versus': 'vs', 'compared': 'vs',
+    'costs': 'cost', 'saving': 'savings', 'profits': 'profit', 'revenues': 'revenue',
+}
+
+# Terms that change the graph's data, not just its wording; they must match exactly
+GRANULARITY_TERMS = frozenset(('daily', 'weekly', 'monthly', 'quarterly', 'yearly', 'month', 'quarter', 'year', 'week', 'day'))
+METRIC_TERMS = frozenset((
+    'roi', 'cost', 'savings', 'revenue', 'profit', 'spend', 'payback', 'margin', 'npv', 'irr',
+    'satisfaction', 'retention', 'engagement', 'productivity', 'efficiency', 'performance',
+))
+
+
+def tokenize(text):
+    text = normalize_request(text).replace('return on investment', 'roi')
+    words = re.findall(r'[\w$%]+', text)
+    return [SYNONYMS.get(word, word) for word in words if word not in STOP_WORDS]
+
+
+def key_terms(tokens):
+    """
+    Numbers, time granularity, metrics and short words (VR, AR, HR, ...): paraphrases
+    must agree on these to share a graph, since one of them barely moves the similarity
+    """
+    return sorted(set(
+        token for token in tokens
+        if token.isdigit() or token in GRANULARITY_TERMS or token in METRIC_TERMS
+        or (token.isalpha() and len(token) <= 3)
+    ))
+
+
+def vectorize(tokens, dim):
+    """Signed feature hashing of words, word bigrams and character trigrams, log-scaled and L2-normalized"""
+    vector = np.zeros(dim, dtype=np.float32)
+    features = list(tokens)
+    features += [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    for token in tokens:
+        padded = f"#{token}#"
+        features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+    for feature in features:
+        h = zlib.crc32(feature.encode('utf-8'))
+        vector[h % dim] += 1.0 if (h >> 31) & 1 else -1.0
+
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """
+    Bounded similarity index of request -> graph code.
+    The least recently used entry is evicted when the matrix is full.
+    """
+
+    def __init__(self, capacity=1000, dim=1024, threshold=0.85, top_k=5, path=None):
+        self.capacity = capacity
+        self.dim = dim
+        self.threshold = threshold
+        self.top_k = top_k
+        self.path = path
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = [None] * capacity  # slot -> {'request', 'terms', 'code'}
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._path_lock = self._lock_path() if path else None
+        self._vectors = self._open_matrix()
+        self._load_entries()
+        self._df = (self._vectors[self._used_slots()] != 0).sum(axis=0).astype(np.float32)
+
+    def _lock_path(self):
+        """
+        Hold a lock on the cache file for the life of the process. Every process keeps its
+        own entry list and rewrites the whole file, so a second process sharing the path
+        would corrupt it; that one keeps its cache in memory instead.
+        """
+        try:
+            lock_file = open(self.path + '.lock', 'w')
+        except OSError as e:
+            logger.error(f"Semantic cache lock unavailable, keeping the cache in memory: {str(e)}")
+            self.path = None
+            return None
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            logger.warning(f"Semantic cache at {self.path} is in use by another process, keeping this one in memory")
+            self.path = None
+            return None
+        return lock_file
+
+    def _open_matrix(self):
+        shape = (self.capacity, self.dim)
+        if not self.path:
+            return np.zeros(shape, dtype=np.float32)
+        try:
+            matrix = np.lib.format.open_memmap(self.path, mode='r+')
+            if matrix.shape == shape and matrix.dtype == np.float32:
+                return matrix
+            logger.warning(f"Semantic cache at {self.path} has shape {matrix.shape}, starting fresh")
+        except (OSError, ValueError):
+            pass
+        return np.lib.format.open_memmap(self.path, mode='w+', dtype=np.float32, shape=shape)
+
+    def _meta_path(self):
+        return self.path + '.json'
+
+    def _load_entries(self):
+        if not self.path or not os.path.exists(self._meta_path()):
+            self._vectors[:] = 0
+            return
+        try:
+            with open(self._meta_path()) as f:
+                meta = json.load(f)
+            for slot, entry in meta['entries'].items():
+                slot = int(slot)
+                if slot < self.capacity:
+                    # Terms are recomputed so entries saved under older rules are checked like new ones
+                    terms = key_terms(tokenize(entry['request']))
+                    self._entries[slot] = {'request': entry['request'], 'terms': terms, 'code': entry['code']}
+                    self._last_used[slot] = entry['last_used']
+            # Rows without metadata are stale; clear them so they never match
+            for slot, entry in enumerate(self._entries):
+                if entry is None:
+                    self._vectors[slot] = 0
+            logger.info(f"Loaded {len(self._used_slots())} semantic cache entries from {self.path}")
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Semantic cache metadata unreadable, starting fresh: {str(e)}")
+            self._entries = [None] * self.capacity
+            self._vectors[:] = 0
+
+    def _used_slots(self):
+        return np.array([slot for slot, entry in enumerate(self._entries) if entry is not None], dtype=np.int64)
+
+    def _idf(self, entries):
+        return np.log((entries + 1) / (self._df + 1)) + 1
+
+    def get(self, user_request):
+        """Graph code stored for the most similar earlier request, or None"""
+        tokens = tokenize(user_request)
+        if not tokens:
+            return None
+        query = vectorize(tokens, self.dim)
+        terms = key_terms(tokens)
+
+        with self._lock:
+            slots = self._used_slots()
+            if len(slots) == 0:
+                self.misses += 1
+                return None
+
+            # Cosine similarity of IDF-weighted vectors, for every stored request at once
+            idf = self._idf(len(slots))
+            weighted_query = query * idf
+            rows = self._vectors[slots] * idf
+            row_norms = np.linalg.norm(rows, axis=1)
+            query_norm = np.linalg.norm(weighted_query)
+            scores = rows @ weighted_query / np.maximum(row_norms * query_norm, 1e-12)
+
+            k = min(self.top_k, len(slots))
+            candidates = np.argpartition(-scores, k - 1)[:k]
+            for index in candidates[np.argsort(-scores[candidates])]:
+                if scores[index] < self.threshold:
+                    break
+                slot = slots[index]
+                entry = self._entries[slot]
+                if entry['terms'] != terms:
+                    continue
+                self._last_used[slot] = time.time()
+                self.hits += 1
+                logger.info(f"Semantic cache hit ({scores[index]:.2f}): '{user_request}' ~ '{entry['request']}'")
+                return entry['code']
+
+            self.misses += 1
+            return None
+
+    def set(self, user_request, code):
+        tokens = tokenize(user_request)
+        if not tokens:
+            return
+        vector = vectorize(tokens, self.dim)
+
+        with self._lock:
+            # Reuse the slot of the same request, else a free one, else the least recently used
+            same = [slot for slot, entry in enumerate(self._entries)
+                    if entry is not None and entry['request'] == user_request]
+            free = [slot for slot, entry in enumerate(self._entries) if entry is None]
+            if same or not free:
+                slot = same[0] if same else int(np.argmin(self._last_used))
+                self._df -= (self._vectors[slot] != 0)
+            else:
+                slot = free[0]
+
+            self._vectors[slot] = vector
+            self._df += (vector != 0)
+            self._entries[slot] = {'request': user_request, 'terms': key_terms(tokens), 'code': code}
+            self._last_used[slot] = time.time()
+            self._flush()
+
+    def _flush(self):
+        if not self.path:
+            return
+        try:
+            self._vectors.flush()
+            meta = {'entries': {
+                str(slot): dict(entry, last_used=float(self._last_used[slot]))
+                for slot, entry in enumerate(self._entries) if entry is not None
+            }}
+            temp_path = self._meta_path() + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(meta, f)
+            os.replace(temp_path, self._meta_path())
+        except OSError as e:
+            logger.error(f"Semantic cache write failed: {str(e)}")
+
+    def clear(self):
+        with self._lock:
+            self._entries = [None] * self.capacity
+            self._vectors[:] = 0
+            self._df[:] = 0
+            self._last_used[:] = 0
+            self._flush()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._used_slots()),
+            }
+
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """Return the process-wide semantic cache, or None if disabled (GRAPH_SEMANTIC_CACHE_SIZE=0)"""
+    global _semantic_cache
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            capacity = int(os.environ.get("GRAPH_SEMANTIC_CACHE_SIZE", 1000))
+            if capacity <= 0:
+                return None
+            try:
+                _semantic_cache = SemanticCache(
+                    capacity=capacity,
+                    threshold=float(os.environ.get("GRAPH_SEMANTIC_CACHE_THRESHOLD", 0.85)),
+                    path=os.environ.get("GRAPH_SEMANTIC_CACHE_PATH") or None
+                )
+            except OSError as e:
+                logger.error(f"Semantic cache disabled: {str(e)}")
+                return None
+        return _semantic_cache
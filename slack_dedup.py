@@ -0,0 +1,134 @@
+"""
+Deduplication of repeated Slack deliveries
+Slack retries a request it thinks timed out (X-Slack-Retry-Num / X-Slack-Retry-Reason);
+a repeat of a request this process has already seen is acknowledged without running
+any listener, so a retry never starts a second generation.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from slack_bolt import BoltResponse
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SLACK_RETRIES = metrics.registry.counter(
+    "roi_slack_retries_total", "Slack retry deliveries received, by retry reason", ("reason",)
+)
+SLACK_DUPLICATES_SUPPRESSED = metrics.registry.counter(
+    "roi_slack_duplicates_suppressed_total", "Repeated Slack deliveries acknowledged without doing any work", ("reason",)
+)
+
+
+class SeenRequests:
+    """Fingerprints of recent requests, forgotten after ttl_seconds or beyond max_entries"""
+
+    def __init__(self, ttl_seconds=600, max_entries=10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._seen = OrderedDict()  # fingerprint -> first seen at
+        self._lock = threading.Lock()
+
+    def seen_before(self, fingerprint):
+        """Record the fingerprint; True if it was already recorded within the TTL"""
+        now = time.time()
+        with self._lock:
+            # Entries are in first-seen order, so expired ones are at the front
+            while self._seen:
+                oldest, seen_at = next(iter(self._seen.items()))
+                if now - seen_at <= self.ttl_seconds:
+                    break
+                del self._seen[oldest]
+
+            if fingerprint in self._seen:
+                return True
+            self._seen[fingerprint] = now
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._seen)
+
+
+def request_fingerprint(body):
+    """
+    Stable identity of a Slack request, the same for every delivery of it:
+    the event id for events, trigger_id/user/text for slash commands and
+    the action timestamp for interactions. None if the request has no identity.
+    """
+    if not isinstance(body, dict):
+        return None
+    if body.get('event_id'):
+        identity = ['event', body['event_id']]
+    elif body.get('command'):
+        identity = ['command', body.get('command'), body.get('trigger_id'), body.get('user_id'), body.get('text')]
+    elif body.get('actions'):
+        user = body.get('user') or {}
+        identity = ['action', body.get('trigger_id'), user.get('id'),
+                    [action.get('action_ts') or action.get('value') for action in body['actions']]]
+    else:
+        return None
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _header(req, name):
+    values = req.headers.get(name) or []
+    return values[0] if values else None
+
+
+_seen_requests = None
+_seen_requests_lock = threading.Lock()
+
+
+def get_seen_requests():
+    global _seen_requests
+    with _seen_requests_lock:
+        if _seen_requests is None:
+            _seen_requests = SeenRequests(
+                ttl_seconds=int(os.environ.get("SLACK_DEDUP_TTL_SECONDS", 600)),
+                max_entries=int(os.environ.get("SLACK_DEDUP_MAX_ENTRIES", 10000))
+            )
+        return _seen_requests
+
+
+def is_duplicate(req):
+    """Record the request and return the suppression reason if it repeats an earlier one, else None"""
+    retry_num = _header(req, 'x-slack-retry-num')
+    retry_reason = _header(req, 'x-slack-retry-reason') or 'unknown'
+    if retry_num:
+        SLACK_RETRIES.inc(reason=retry_reason)
+
+    fingerprint = request_fingerprint(req.body)
+    if fingerprint is None or not get_seen_requests().seen_before(fingerprint):
+        return None
+
+    reason = retry_reason if retry_num else 'duplicate'
+    SLACK_DUPLICATES_SUPPRESSED.inc(reason=reason)
+    logger.info(f"Acknowledged repeated Slack delivery without work (retry {retry_num or 0}, reason {reason})")
+    return reason
+
+
+def _duplicate_response():
+    # Tell Slack the request was handled so it stops retrying
+    return BoltResponse(status=200, body="", headers={'X-Slack-No-Retry': '1'})
+
+
+def dedup_middleware(req, resp, next):
+    """Bolt global middleware for App"""
+    if is_duplicate(req):
+        return _duplicate_response()
+    return next()
+
+
+async def async_dedup_middleware(req, resp, next):
+    """Bolt global middleware for AsyncApp"""
+    if is_duplicate(req):
+        return _duplicate_response()
+    return await next()
@@ -0,0 +1,137 @@
+"""
+Slack message text and blocks shared by the Flask and ASGI serving modes
+"""
+
+import re
+import math
+
+# Render profile offered through the "High-res version" button
+HIGH_RES_PROFILE = "high-res"
+
+EMPTY_REQUEST_TEXT = "Please provide a description for your ROI graph!\nExample: `/roi VR training vs traditional training over 3 years`"
+
+EMPTY_BATCH_TEXT = "Please provide your graph descriptions, separated by `;` or new lines!\nExample: `/roi-batch VR training ROI monthly; VR training ROI quarterly; VR training ROI yearly`"
+
+QUEUE_FULL_TEXT = "⏳ The ROI bot is busy right now. Please try again in a minute."
+
+HELP_TEXT = """
+📊 *ROI Graph Generator Help*
+
+*Usage:* `/roi [your request]`
+
+*Example requests:*
+• `/roi VR training vs traditional training ROI over 3 years`
+• `/roi Cost savings from VR implementation quarterly breakdown`
+• `/roi Training efficiency improvements monthly comparison`
+• `/roi Employee satisfaction before and after VR training`
+
+*Several graphs at once:* `/roi-batch [request]; [request]; ...`
+• `/roi-batch VR training ROI monthly; VR training ROI quarterly; VR training ROI yearly`
+
+*Tips:*
+• Be specific about time periods (monthly, quarterly, yearly)
+• Mention what you're comparing (VR vs traditional, before vs after)
+• Include context about your industry if relevant
+
+*Need help?* Contact your admin or try simpler requests first.
+        """
+
+
+def rate_limited_text(decision):
+    """Reply for a request rejected by admission control"""
+    wait_seconds = max(1, math.ceil(decision.retry_after))
+    who = {'user': "You're", 'team': "Your workspace is", 'global': "Everyone is"}[decision.reason]
+    return f"🚦 {who} requesting graphs faster than the bot allows. Try again in {wait_seconds}s."
+
+
+def generating_text(user_text):
+    return f"🎯 Generating ROI graph for: *{user_text}*\nThis may take 15-30 seconds..."
+
+
+def upload_kwargs(user_text, profile, image_data, upload_id=None):
+    """files_upload_v2 arguments for a finished graph; upload_id makes the filename unique to one job"""
+    return {
+        'file': image_data,
+        'filename': f"roi_graph_{upload_id}.{profile.file_extension}" if upload_id else f"roi_graph.{profile.file_extension}",
+        'title': f"ROI Analysis: {user_text[:50]}{'...' if len(user_text) > 50 else ''}",
+        'initial_comment': f"📊 Here's your ROI analysis for: *{user_text}*",
+    }
+
+
+def preview_upload_kwargs(user_text, profile, image_data):
+    """files_upload_v2 arguments for the quick preview posted while the full graph generates"""
+    return {
+        'file': image_data,
+        'filename': f"roi_graph_preview.{profile.file_extension}",
+        'title': f"Preview: {user_text[:50]}{'...' if len(user_text) > 50 else ''}",
+        'initial_comment': f"⚡ Quick preview for *{user_text}* - the full graph will replace it in a few seconds",
+    }
+
+
+def uploaded_file_id(response):
+    """ID of the single file in a files_upload_v2 response, if any"""
+    return (response.get('file') or {}).get('id')
+
+
+def parse_batch_text(text, max_items):
+    """
+    Split a /roi-batch command into its requests (separated by ';' or new lines)
+    Returns (items, skipped): at most max_items requests, and how many were left out
+    """
+    items = [item.strip() for item in re.split(r'[;\n]', text)]
+    # Duplicates would only upload the same graph twice
+    items = list(dict.fromkeys(item for item in items if item))
+    return items[:max_items], max(0, len(items) - max_items)
+
+
+def batch_generating_text(items, skipped=0):
+    listing = "\n".join(f"• *{item}*" for item in items)
+    text = f"🎯 Generating {len(items)} ROI graphs:\n{listing}\nThis may take 15-30 seconds..."
+    if skipped:
+        text += (f"\n⚠️ Skipped {skipped} more {'request' if skipped == 1 else 'requests'}: "
+                 f"a batch holds at most {len(items)} graphs")
+    return text
+
+
+def batch_upload_kwargs(results, profile, upload_id=None):
+    """
+    files_upload_v2 arguments for the graphs of one batch; results is [(user_text, image_data or error)]
+    upload_id makes the filenames unique to one job
+    """
+    file_uploads = []
+    failed = []
+    for i, (user_text, result) in enumerate(results, 1):
+        if isinstance(result, Exception):
+            failed.append(user_text)
+            continue
+        file_uploads.append({
+            'file': result,
+            'filename': f"roi_graph_{upload_id}_{i}.{profile.file_extension}" if upload_id else f"roi_graph_{i}.{profile.file_extension}",
+            'title': f"ROI Analysis: {user_text[:50]}{'...' if len(user_text) > 50 else ''}",
+        })
+
+    comment = f"📊 Here are your {len(file_uploads)} ROI graphs:\n" + "\n".join(
+        f"• *{user_text}*" for user_text, result in results if not isinstance(result, Exception)
+    )
+    if failed:
+        comment += "\n\n❌ Couldn't generate: " + ", ".join(f"*{user_text}*" for user_text in failed)
+    return {'file_uploads': file_uploads, 'initial_comment': comment}
+
+
+def high_res_blocks(user_text):
+    """Button that re-renders the graph with the high-res profile"""
+    return [
+        {
+            "type": "actions",
+            "elements": [{
+                "type": "button",
+                "action_id": "roi_high_res",
+                "text": {"type": "plain_text", "text": "🔍 High-res version"},
+                "value": user_text[:2000]
+            }]
+        }
+    ]
+
+
+def error_text(error):
+    return f"❌ Sorry, I couldn't generate that graph. Error: {str(error)[:200]}...\n\nTry rephrasing your request or contact support."
@@ -46,18 +46,13 @@ def test_graph_generation():
             
             try:
                 # Generate the graph
-                image_path = generate_roi_graph(request)
+                image_data = generate_roi_graph(request)
                 
-                if os.path.exists(image_path):
-                    file_size = os.path.getsize(image_path)
-                    print(f"✅ Success! Graph saved to: {image_path}")
-                    print(f"📁 File size: {file_size:,} bytes")
-                    
-                    # Clean up the temp file
-                    os.remove(image_path)
-                    print("🧹 Cleaned up temporary file")
+                if image_data:
+                    print("✅ Success! Graph generated in memory")
+                    print(f"📁 Image size: {len(image_data):,} bytes")
                 else:
-                    print("❌ Error: Graph file was not created")
+                    print("❌ Error: Graph image was empty")
                     
             except Exception as e:
                 print(f"❌ Error generating graph: {str(e)}")